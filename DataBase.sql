@@ -63,15 +63,49 @@ CREATE TABLE product_workshops (
     UNIQUE(product_id, workshop_id)
 );
 
+-- Таблица: Версия данных каталога (для кэширования страниц)
+CREATE TABLE data_versions (
+    id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 1 - версия каталога, 2 - версия справочников
+INSERT INTO data_versions (id, version) VALUES (1, 0), (2, 0);
+
+-- Журнал изменений продукции для инкрементальной синхронизации (лента /changes)
+CREATE TABLE product_changes (
+    id SERIAL PRIMARY KEY,
+    product_id INTEGER,
+    article VARCHAR(50),
+    operation VARCHAR(10) NOT NULL,
+    fields VARCHAR(500),
+    version INTEGER NOT NULL,
+    changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Создание индексов для ускорения запросов
 CREATE INDEX idx_products_article ON products(article);
 CREATE INDEX idx_products_type ON products(product_type_id);
+CREATE INDEX idx_products_name ON products(name, id);
+CREATE INDEX idx_products_cost ON products(min_cost_for_partner, id);
+CREATE INDEX idx_products_production_time ON products(production_time, id);
 CREATE INDEX idx_product_workshops_product ON product_workshops(product_id);
 CREATE INDEX idx_product_workshops_workshop ON product_workshops(workshop_id);
 
+-- Индексы поиска продукции: префикс артикула, полнотекстовый поиск по названию и описанию,
+-- нечеткий поиск по названию (расширение pg_trgm)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX idx_products_article_prefix ON products(article text_pattern_ops);
+CREATE INDEX idx_products_search ON products
+    USING GIN (to_tsvector('russian', coalesce(name, '') || ' ' || coalesce(description, '')));
+CREATE INDEX idx_products_name_trgm ON products USING GIN (name gin_trgm_ops);
+
 -- Комментарии к таблицам
 COMMENT ON TABLE product_types IS 'Типы продукции с коэффициентами для расчета';
 COMMENT ON TABLE material_types IS 'Типы материалов с процентом потерь';
 COMMENT ON TABLE workshops IS 'Цеха производства';
 COMMENT ON TABLE products IS 'Продукция компании';
-COMMENT ON TABLE product_workshops IS 'Связь продукции с цехами и время производства';
\ No newline at end of file
+COMMENT ON TABLE product_workshops IS 'Связь продукции с цехами и время производства';
+COMMENT ON TABLE data_versions IS 'Версия данных каталога для кэширования страниц';
+COMMENT ON TABLE product_changes IS 'Журнал изменений продукции для синхронизации внешних систем';
\ No newline at end of file
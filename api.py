@@ -0,0 +1,342 @@
+from models import Product, ProductType, MaterialType, Workshop, ProductWorkshop, DataVersion
+from cache import ProductTypeRow, MaterialTypeRow, WorkshopRow, REFERENCE_VERSION_ID
+from services import (products_page_statement, products_page_result, calculate_raw_material_batch,
+                      ORDER_LINE_FIELDS)
+from config import Config
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from urllib.parse import parse_qs
+import argparse
+import asyncio
+import json
+import re
+
+# Асинхронные драйверы для URL из SQLALCHEMY_DATABASE_URI
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+# Большие пакетные расчеты считаются в отдельном потоке, чтобы не останавливать цикл событий
+BATCH_THREAD_THRESHOLD = 1000
+
+_engine = None
+_sessionmaker = None
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def async_database_url(url):
+    """Подставляет асинхронный драйвер в URL подключения"""
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.drivername)
+    return url.set(drivername=driver) if driver else url
+
+
+def create_engine_from_config(config=Config):
+    url = async_database_url(getattr(config, 'API_DATABASE_URL', None) or config.SQLALCHEMY_DATABASE_URI)
+    options = {}
+    # SQLite в памяти живет в одном соединении, пул для нее не настраивается
+    if not (url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')):
+        # Пул на процесс: pool_size соединений держатся открытыми, max_overflow добавляется
+        # на пиках; pool_timeout ограничивает ожидание свободного соединения, чтобы при
+        # перегрузке клиент быстро получил ошибку, а не висел в очереди
+        options = {
+            'pool_size': config.API_POOL_SIZE,
+            'max_overflow': config.API_MAX_OVERFLOW,
+            'pool_timeout': config.API_POOL_TIMEOUT,
+            'pool_recycle': config.API_POOL_RECYCLE,
+            'pool_pre_ping': True,
+        }
+    return create_async_engine(url, **options)
+
+
+def get_sessionmaker():
+    global _engine, _sessionmaker
+    if _sessionmaker is None:
+        _engine = create_engine_from_config()
+        # Объекты отдаются сразу после чтения, перечитывать их после commit не нужно
+        _sessionmaker = async_sessionmaker(_engine, expire_on_commit=False)
+    return _sessionmaker
+
+
+async def dispose_engine():
+    global _engine, _sessionmaker
+    if _engine is not None:
+        await _engine.dispose()
+    _engine = None
+    _sessionmaker = None
+
+
+class AsyncReferenceCache:
+    """Справочники для расчета сырья в памяти процесса API.
+
+    Записи каталога идут через Flask-приложение и импорт в других процессах, поэтому
+    актуальность проверяется по версии справочников (data_versions), а не по событиям сессии."""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self.version = None
+        self.product_types = []
+        self.material_types = []
+        self.workshops = []
+
+    async def refresh(self, session):
+        version = (await session.execute(select(DataVersion.version).where(DataVersion.id == REFERENCE_VERSION_ID))).scalar() or 0
+        if version == self.version:
+            return
+        async with self._lock:
+            if version == self.version:
+                return
+            self.product_types = [ProductTypeRow(*row) for row in await session.execute(
+                select(ProductType.id, ProductType.name, ProductType.coefficient).order_by(ProductType.name))]
+            self.material_types = [MaterialTypeRow(*row) for row in await session.execute(
+                select(MaterialType.id, MaterialType.name, MaterialType.waste_percentage).order_by(MaterialType.name))]
+            self.workshops = [WorkshopRow(*row) for row in await session.execute(
+                select(Workshop.id, Workshop.name, Workshop.worker_count).order_by(Workshop.name))]
+            self.version = version
+
+
+reference_data = AsyncReferenceCache()
+
+
+def _int_arg(query, name, default=None):
+    value = query.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ApiError(400, f"Параметр {name} должен быть целым числом")
+
+
+def _float_arg(query, name):
+    value = query.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ApiError(400, f"Параметр {name} должен быть числом")
+
+
+def _product_json(product, production_time):
+    return {
+        'id': product.id,
+        'article': product.article,
+        'name': product.name,
+        'product_type': product.product_type.name,
+        'min_cost_for_partner': float(product.min_cost_for_partner),
+        'production_time': production_time,
+    }
+
+
+async def list_products(session, query, body):
+    per_page = _int_arg(query, 'per_page', Config.PRODUCTS_PER_PAGE)
+    per_page = max(1, min(per_page, Config.PRODUCTS_MAX_PER_PAGE))
+    filters = {name: _float_arg(query, name) for name in ('min_time', 'max_time')}
+    filters = {name: value for name, value in filters.items() if value is not None}
+
+    try:
+        statement, sort, descending = products_page_statement(sort=query.get('sort', 'article'),
+                                                              order=query.get('order', 'asc'),
+                                                              cursor=query.get('cursor'),
+                                                              per_page=per_page,
+                                                              **filters)
+    except ValueError as e:
+        raise ApiError(400, str(e))
+    rows = (await session.execute(statement)).all()
+    page = products_page_result(rows, per_page, sort, descending)
+
+    return {
+        'products': [_product_json(product, page['production_times'][product.id]) for product in page['products']],
+        'sort': page['sort'],
+        'order': page['order'],
+        'per_page': per_page,
+        'filters': filters,
+        'next_cursor': page['next_cursor'],
+    }
+
+
+async def get_product(session, query, body, product_id):
+    row = (await session.execute(select(Product, ProductType.name)
+                                 .join(Product.product_type)
+                                 .where(Product.id == product_id))).first()
+    if row is None:
+        raise ApiError(404, f"Продукция с ID {product_id} не найдена")
+    product, product_type = row
+    return {
+        'id': product.id,
+        'article': product.article,
+        'name': product.name,
+        'description': product.description,
+        'product_type_id': product.product_type_id,
+        'product_type': product_type,
+        'main_material_id': product.main_material_id,
+        'min_cost_for_partner': float(product.min_cost_for_partner),
+        'parameter1': float(product.parameter1 or 0),
+        'parameter2': float(product.parameter2 or 0),
+        'production_time': round(float(product.production_time or 0)),
+    }
+
+
+async def product_workshops(session, query, body, product_id):
+    production_time = (await session.execute(select(Product.production_time)
+                                             .where(Product.id == product_id))).first()
+    if production_time is None:
+        raise ApiError(404, f"Продукция с ID {product_id} не найдена")
+    rows = await session.execute(select(Workshop.id, Workshop.name, ProductWorkshop.time_in_workshop,
+                                        ProductWorkshop.worker_count)
+                                 .join(ProductWorkshop, ProductWorkshop.workshop_id == Workshop.id)
+                                 .where(ProductWorkshop.product_id == product_id)
+                                 .order_by(Workshop.name))
+    return {
+        'product_id': product_id,
+        'production_time': round(float(production_time[0] or 0)),
+        'workshops': [{'id': workshop_id, 'name': name, 'time_in_workshop': float(hours),
+                       'worker_count': workers} for workshop_id, name, hours, workers in rows],
+    }
+
+
+async def production_times(session, query, body):
+    try:
+        product_ids = [int(value) for value in query.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        raise ApiError(400, "Параметр ids - список ID продукции через запятую")
+    if len(product_ids) > Config.PRODUCTS_MAX_PER_PAGE:
+        raise ApiError(400, f"Не больше {Config.PRODUCTS_MAX_PER_PAGE} ID за запрос")
+
+    times = {product_id: 0 for product_id in product_ids}
+    if product_ids:
+        rows = await session.execute(select(Product.id, Product.production_time).where(Product.id.in_(product_ids)))
+        for product_id, total_time in rows:
+            times[product_id] = round(float(total_time or 0))
+    return {'production_times': {str(product_id): value for product_id, value in times.items()}}
+
+
+async def list_workshops(session, query, body):
+    await reference_data.refresh(session)
+    return {'workshops': [row._asdict() for row in reference_data.workshops]}
+
+
+async def material(session, query, body):
+    await reference_data.refresh(session)
+    line = {field: query.get(field) for field in ORDER_LINE_FIELDS}
+    result = calculate_raw_material_batch([line], reference_data.product_types, reference_data.material_types)
+    line = result['lines'][0]
+    if line['error']:
+        raise ApiError(400, line['error'])
+    return {field: line[field] for field in ORDER_LINE_FIELDS + ('result',)}
+
+
+async def material_batch(session, query, body):
+    try:
+        payload = json.loads(body or b'null')
+    except ValueError:
+        raise ApiError(400, "Тело запроса должно быть JSON")
+    lines = payload.get('lines') if isinstance(payload, dict) else payload
+    if not isinstance(lines, list) or not all(isinstance(line, dict) for line in lines):
+        raise ApiError(400, "Ожидается список строк заказа")
+
+    await reference_data.refresh(session)
+    if len(lines) >= BATCH_THREAD_THRESHOLD:
+        return await asyncio.to_thread(calculate_raw_material_batch, lines,
+                                       reference_data.product_types, reference_data.material_types)
+    return calculate_raw_material_batch(lines, reference_data.product_types, reference_data.material_types)
+
+
+ROUTES = [
+    ('GET', re.compile(r'/api/products'), list_products),
+    ('GET', re.compile(r'/api/products/(\d+)'), get_product),
+    ('GET', re.compile(r'/api/products/(\d+)/workshops'), product_workshops),
+    ('GET', re.compile(r'/api/production-times'), production_times),
+    ('GET', re.compile(r'/api/workshops'), list_workshops),
+    ('GET', re.compile(r'/api/material'), material),
+    ('POST', re.compile(r'/api/material/batch'), material_batch),
+]
+
+
+def resolve(method, path):
+    """Находит обработчик маршрута; возвращает (обработчик, параметры пути) или ApiError"""
+    path_found = False
+    for route_method, pattern, handler in ROUTES:
+        match = pattern.fullmatch(path.rstrip('/') or '/')
+        if match:
+            path_found = True
+            if route_method == method:
+                return handler, [int(value) for value in match.groups()]
+    if path_found:
+        raise ApiError(405, "Метод не поддерживается")
+    raise ApiError(404, "Маршрут не найден")
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json; charset=utf-8'),
+                    (b'content-length', str(len(body)).encode('ascii'))],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            get_sessionmaker()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await dispose_engine()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    try:
+        handler, path_args = resolve(scope['method'], scope['path'])
+        query = {name: values[0] for name, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+        body = await _read_body(receive) if scope['method'] == 'POST' else b''
+        # Соединение берется из пула на время обработки запроса и сразу возвращается
+        async with get_sessionmaker()() as session:
+            payload = await handler(session, query, body, *path_args)
+        await _send_json(send, 200, payload)
+    except ApiError as e:
+        await _send_json(send, e.status, {'error': e.message})
+    except Exception as e:
+        print(f"Ошибка API {scope['method']} {scope['path']}: {str(e)}")
+        await _send_json(send, 500, {'error': 'Внутренняя ошибка сервера'})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Асинхронный JSON API каталога")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1, help="количество процессов")
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run('api:app', host=args.host, port=args.port, workers=args.workers, access_log=False)
@@ -1,30 +1,242 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import render_template, request, redirect, url_for, flash, jsonify, abort, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from models import db, Product, ProductType, MaterialType, Workshop, ProductWorkshop
-from forms import ProductForm, MaterialCalculatorForm
-from services import calculate_production_time, calculate_raw_material
-from config import Config
-import os
+from models import db, Product, Workshop, ProductWorkshop
+from forms import ProductForm, MaterialCalculatorForm, PlannerForm
+from cache import reference_cache, cached_view, bump_data_version
+from planner import parse_order_text, plan_production
+from search import search_products, autocomplete_articles
+from changes import get_changes
+from metrics import init_metrics
+from jobs import submit_job, job_store, job_json, FINISHED_STATUSES
+from services import (calculate_production_time, calculate_raw_material, calculate_raw_material_batch,
+                      parse_order_lines_csv, get_products_page, product_filter_conditions,
+                      bulk_update_products, delete_products, export_products_csv, export_products_xlsx,
+                      get_workshop_summary, get_workshop_products_page)
+from factory import create_app
+from decimal import Decimal, InvalidOperation
+import math
 
-app = Flask(__name__)
-app.config.from_object(Config)
-db.init_app(app)
+app = create_app(__name__)
+init_metrics(app)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/products')
+@cached_view
 def products():
-    all_products = Product.query.all()
-    production_times = {}
+    per_page = request.args.get('per_page', app.config['PRODUCTS_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, app.config['PRODUCTS_MAX_PER_PAGE']))
+    # Фильтр по времени изготовления (часы); пустые значения не учитываются
+    filters = {name: request.args.get(name, type=float)
+               for name in ('min_time', 'max_time') if request.args.get(name, type=float) is not None}
     
-    for product in all_products:
-        production_times[product.id] = calculate_production_time(product.id)
+    try:
+        page = get_products_page(sort=request.args.get('sort', 'article'),
+                                 order=request.args.get('order', 'asc'),
+                                 cursor=request.args.get('cursor'),
+                                 per_page=per_page,
+                                 **filters)
+    except ValueError as e:
+        print(f"Ошибка при загрузке каталога: {str(e)}")
+        abort(400)
+    
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'products': [{
+                'id': product.id,
+                'article': product.article,
+                'name': product.name,
+                'product_type': product.product_type.name,
+                'min_cost_for_partner': float(product.min_cost_for_partner),
+                'production_time': page['production_times'][product.id],
+            } for product in page['products']],
+            'sort': page['sort'],
+            'order': page['order'],
+            'per_page': per_page,
+            'filters': filters,
+            'next_cursor': page['next_cursor'],
+        })
     
     return render_template('products.html', 
-                         products=all_products,
-                         production_times=production_times)
+                         products=page['products'],
+                         production_times=page['production_times'],
+                         sort=page['sort'],
+                         order=page['order'],
+                         per_page=per_page,
+                         filters=filters,
+                         next_cursor=page['next_cursor'],
+                         product_types=reference_cache.product_types(),
+                         material_types=reference_cache.material_types())
+
+def product_filters(source):
+    """Отбор продукции из формы, строки запроса или JSON: ids, product_type_id, material_type_id, min_time, max_time.
+    При некорректных значениях выбрасывает ValueError."""
+    filters = {}
+    ids = source.getlist('ids') if hasattr(source, 'getlist') else source.get('ids')
+    if isinstance(ids, str):
+        ids = ids.split(',')
+    if ids:
+        try:
+            filters['ids'] = [int(value) for value in ids if str(value).strip()]
+        except (TypeError, ValueError):
+            raise ValueError(f"Некорректный список продукции: {ids}")
+    for name, cast in (('product_type_id', int), ('material_type_id', int), ('min_time', float), ('max_time', float)):
+        value = source.get(name)
+        if value not in (None, ''):
+            try:
+                filters[name] = cast(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Некорректное значение {name}: {value}")
+            if not math.isfinite(filters[name]):
+                raise ValueError(f"Некорректное значение {name}: {value}")
+    return filters
+
+def bulk_selection(source):
+    """Условия массовой операции: отмеченная продукция или, с явным all, все по фильтру"""
+    filters = product_filters(source)
+    if 'ids' not in filters and str(source.get('all', '')).lower() not in ('1', 'true', 'on'):
+        raise ValueError('Не выбрана продукция: отметьте строки или подтвердите операцию для всех по фильтру')
+    return filters, product_filter_conditions(**filters)
+
+def bulk_redirect(filters):
+    return redirect(url_for('products', **{name: value for name, value in filters.items() if name != 'ids'}))
+
+@app.route('/products/bulk-update', methods=['POST'])
+def bulk_update():
+    source = request.get_json(silent=True) if request.is_json else request.form
+    if not isinstance(source, dict):
+        return jsonify({'error': 'Ожидается JSON-объект'}), 400
+    filters = {}
+    
+    try:
+        filters, conditions = bulk_selection(source)
+        # Новые значения передаются с префиксом new_, чтобы не путать их с фильтрами отбора
+        changes = {}
+        for name, field in (('min_cost_for_partner', 'new_min_cost_for_partner'),
+                            ('cost_change_percent', 'cost_change_percent')):
+            value = source.get(field)
+            if value not in (None, ''):
+                changes[name] = Decimal(str(value).replace(',', '.'))
+                # Decimal принимает 'Infinity' и 'NaN', которые проходят проверки ниже
+                if not changes[name].is_finite():
+                    raise ValueError('Некорректное число')
+        for name, field in (('product_type_id', 'new_product_type_id'), ('main_material_id', 'new_main_material_id')):
+            value = source.get(field)
+            # 0 в форме означает "не менять"
+            if value not in (None, '', 0, '0'):
+                try:
+                    changes[name] = int(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f"Некорректное значение {field}: {value}")
+        
+        if not changes:
+            raise ValueError('Не указано, что изменить')
+        if changes.get('min_cost_for_partner', 0) < 0:
+            raise ValueError('Стоимость не может быть отрицательной')
+        if changes.get('cost_change_percent', 0) < -100:
+            raise ValueError('Стоимость нельзя уменьшить больше чем на 100%')
+        if 'product_type_id' in changes and not reference_cache.product_type(changes['product_type_id']):
+            raise ValueError(f"Тип продукции с ID {changes['product_type_id']} не найден")
+        if 'main_material_id' in changes and not reference_cache.material_type(changes['main_material_id']):
+            raise ValueError(f"Тип материала с ID {changes['main_material_id']} не найден")
+    except (ValueError, InvalidOperation) as e:
+        message = str(e) if isinstance(e, ValueError) else 'Некорректное число'
+        if request.is_json:
+            return jsonify({'error': message}), 400
+        flash(message, 'error')
+        return bulk_redirect(filters)
+    
+    try:
+        updated = bulk_update_products(conditions, **changes)
+        bump_data_version()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Ошибка при массовом изменении продукции: {str(e)}")
+        if request.is_json:
+            return jsonify({'error': f'Ошибка при массовом изменении продукции: {str(e)}'}), 500
+        flash(f'Ошибка при массовом изменении продукции: {str(e)}', 'error')
+        return bulk_redirect(filters)
+    
+    if request.is_json:
+        return jsonify({'updated': updated})
+    flash(f'Изменено продуктов: {updated}', 'success')
+    return bulk_redirect(filters)
+
+@app.route('/products/bulk-delete', methods=['POST'])
+def bulk_delete():
+    source = request.get_json(silent=True) if request.is_json else request.form
+    if not isinstance(source, dict):
+        return jsonify({'error': 'Ожидается JSON-объект'}), 400
+    filters = {}
+    
+    try:
+        filters, conditions = bulk_selection(source)
+        deleted = delete_products(conditions)
+        bump_data_version()
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        if request.is_json:
+            return jsonify({'error': str(e)}), 400
+        flash(str(e), 'error')
+        return bulk_redirect(filters)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Ошибка при массовом удалении продукции: {str(e)}")
+        if request.is_json:
+            return jsonify({'error': f'Ошибка при массовом удалении продукции: {str(e)}'}), 500
+        flash(f'Ошибка при массовом удалении продукции: {str(e)}', 'error')
+        return bulk_redirect(filters)
+    
+    if request.is_json:
+        return jsonify({'deleted': deleted})
+    flash(f'Удалено продуктов: {deleted}', 'success')
+    return bulk_redirect(filters)
+
+@app.route('/products/export')
+def export_products():
+    # Выгрузка текущего вида каталога (те же фильтры и сортировка), файл отдается по мере чтения строк
+    try:
+        conditions = product_filter_conditions(**product_filters(request.args))
+    except ValueError:
+        abort(400)
+    sort = request.args.get('sort', 'article')
+    order = request.args.get('order', 'asc')
+    
+    if request.args.get('format') == 'xlsx':
+        body = export_products_xlsx(conditions, sort, order)
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        filename = 'products.xlsx'
+    else:
+        body = export_products_csv(conditions, sort, order)
+        mimetype = 'text/csv; charset=utf-8'
+        filename = 'products.csv'
+    
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+@app.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', app.config['SEARCH_RESULTS_LIMIT'], type=int)
+    limit = max(1, min(limit, app.config['SEARCH_RESULTS_LIMIT']))
+    results = search_products(query, limit) if query else []
+    
+    if request.args.get('format') == 'json':
+        return jsonify({'query': query, 'results': results})
+    
+    return render_template('search.html', query=query, results=results)
+
+@app.route('/search/articles')
+def search_articles():
+    # Автодополнение артикула по префиксу
+    limit = request.args.get('limit', 10, type=int)
+    limit = max(1, min(limit, app.config['SEARCH_RESULTS_LIMIT']))
+    return jsonify({'results': autocomplete_articles(request.args.get('prefix', ''), limit)})
 
 @app.route('/product/add', methods=['GET', 'POST'])
 def add_product():
@@ -50,6 +262,7 @@ def add_product():
             )
             
             db.session.add(new_product)
+            bump_data_version()
             db.session.commit()
             
             flash('Продукт успешно добавлен!', 'success')
@@ -83,6 +296,7 @@ def edit_product(product_id):
             product.parameter1 = form.parameter1.data or 0
             product.parameter2 = form.parameter2.data or 0
             
+            bump_data_version()
             db.session.commit()
             flash('Продукт успешно обновлен!', 'success')
             return redirect(url_for('products'))
@@ -96,16 +310,14 @@ def edit_product(product_id):
 @app.route('/product/delete/<int:product_id>', methods=['POST'])
 def delete_product(product_id):
     try:
-        product = Product.query.get_or_404(product_id)
-        
-        # Сначала удаляем связанные записи в product_workshops
-        ProductWorkshop.query.filter_by(product_id=product_id).delete()
-        
-        # Затем удаляем сам продукт
-        db.session.delete(product)
-        db.session.commit()
-        
-        flash('Продукт успешно удален!', 'success')
+        # Связи с цехами и сам продукт удаляются двумя DELETE, без загрузки связей через каскад ORM
+        if delete_products(product_filter_conditions(ids=[product_id])):
+            bump_data_version()
+            db.session.commit()
+            flash('Продукт успешно удален!', 'success')
+        else:
+            db.session.rollback()
+            flash('Продукт не найден', 'error')
     except Exception as e:
         db.session.rollback()
         print(f"Ошибка при удалении продукта: {str(e)}")
@@ -114,6 +326,7 @@ def delete_product(product_id):
     return redirect(url_for('products'))
 
 @app.route('/product/workshops/<int:product_id>')
+@cached_view
 def workshops(product_id):
     product = Product.query.get_or_404(product_id)
     product_workshops = ProductWorkshop.query.filter_by(product_id=product_id).all()
@@ -122,8 +335,54 @@ def workshops(product_id):
     return render_template('workshops.html', 
                          product=product, 
                          workshops=product_workshops,
+                         workshops_by_id=reference_cache.workshops_by_id(),
                          total_time=total_time)
 
+@app.route('/workshops')
+@cached_view
+def workshop_dashboard():
+    summary = get_workshop_summary()
+    
+    if request.args.get('format') == 'json':
+        return jsonify(summary)
+    
+    return render_template('workshop_dashboard.html', summary=summary)
+
+@app.route('/workshops/<int:workshop_id>')
+@cached_view
+def workshop_products(workshop_id):
+    workshop = reference_cache.workshops_by_id().get(workshop_id)
+    if workshop is None:
+        abort(404)
+    per_page = request.args.get('per_page', app.config['PRODUCTS_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, app.config['PRODUCTS_MAX_PER_PAGE']))
+    
+    try:
+        page = get_workshop_products_page(workshop_id, cursor=request.args.get('cursor'), per_page=per_page)
+    except ValueError as e:
+        print(f"Ошибка при загрузке продукции цеха: {str(e)}")
+        abort(400)
+    
+    if request.args.get('format') == 'json':
+        return jsonify(dict(page, workshop=workshop._asdict(), per_page=per_page))
+    
+    return render_template('workshop_products.html', workshop=workshop, per_page=per_page, **page)
+
+@app.route('/changes')
+@cached_view
+def changes():
+    # Лента для внешних систем: изменения после курсора since по порядку; следующий запрос
+    # делается с since=next_cursor, пока has_more не станет false
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', app.config['CHANGES_PER_PAGE']))
+    except ValueError:
+        return jsonify({'error': 'since и limit должны быть целыми числами'}), 400
+    if since < 0:
+        return jsonify({'error': 'since не может быть отрицательным'}), 400
+    limit = max(1, min(limit, app.config['CHANGES_MAX_PER_PAGE']))
+    return jsonify(get_changes(since, limit))
+
 @app.route('/material-calculator', methods=['GET', 'POST'])
 def material_calculator():
     form = MaterialCalculatorForm()
@@ -132,8 +391,8 @@ def material_calculator():
     material_type = None
     
     # Получаем типы продукции и материалов
-    product_types = ProductType.query.all()
-    material_types = MaterialType.query.all()
+    product_types = reference_cache.product_types()
+    material_types = reference_cache.material_types()
     
     if not product_types or not material_types:
         flash('Нет данных о типах продукции или материалах. Проверьте импорт данных.', 'error')
@@ -152,8 +411,8 @@ def material_calculator():
             if result == -1:
                 flash('Ошибка при расчете. Проверьте введенные данные.', 'error')
             else:
-                product_type = ProductType.query.get(form.product_type_id.data)
-                material_type = MaterialType.query.get(form.material_type_id.data)
+                product_type = reference_cache.product_type(form.product_type_id.data)
+                material_type = reference_cache.material_type(form.material_type_id.data)
                 flash('Расчет успешно выполнен!', 'success')
         except Exception as e:
             print(f"Ошибка при расчете: {str(e)}")
@@ -167,15 +426,104 @@ def material_calculator():
                          product_types=product_types,
                          material_types=material_types)
 
-if __name__ == '__main__':
-    # Создаем папки для статики и шаблонов при первом запуске
-    os.makedirs('static/css', exist_ok=True)
-    os.makedirs('static/img', exist_ok=True)
-    os.makedirs('static/js', exist_ok=True)
-    os.makedirs('templates', exist_ok=True)
+@app.route('/material-calculator/batch', methods=['POST'])
+def material_calculator_batch():
+    # Строки заказа принимаются JSON-массивом ({"lines": [...]}) или CSV-файлом в поле "file"
+    if 'file' in request.files:
+        try:
+            lines = parse_order_lines_csv(request.files['file'].stream)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        payload = request.get_json(silent=True)
+        lines = payload.get('lines') if isinstance(payload, dict) else payload
+    
+    if not isinstance(lines, list) or not all(isinstance(line, dict) for line in lines):
+        return jsonify({'error': 'Ожидается список строк заказа'}), 400
+    
+    try:
+        return jsonify(calculate_raw_material_batch(lines))
+    except Exception as e:
+        print(f"Ошибка при пакетном расчете: {str(e)}")
+        return jsonify({'error': f'Ошибка при пакетном расчете: {str(e)}'}), 500
+
+@app.route('/planner', methods=['GET', 'POST'])
+def planner():
+    form = PlannerForm()
+    plan = None
+    
+    if form.validate_on_submit():
+        try:
+            lines, errors = parse_order_text(form.order.data)
+            plan = plan_production(lines)
+            for error in errors + plan['errors']:
+                flash(error, 'error')
+        except Exception as e:
+            print(f"Ошибка при планировании: {str(e)}")
+            flash(f'Ошибка при планировании: {str(e)}', 'error')
+    
+    return render_template('planner.html', form=form, plan=plan)
+
+@app.route('/planner/plan', methods=['POST'])
+def planner_plan():
+    # Заказ принимается JSON-массивом строк {"article" или "product_id", "quantity"} или {"lines": [...]}
+    payload = request.get_json(silent=True)
+    lines = payload.get('lines') if isinstance(payload, dict) else payload
+    
+    if not isinstance(lines, list) or not all(isinstance(line, dict) for line in lines):
+        return jsonify({'error': 'Ожидается список строк заказа'}), 400
+    
+    try:
+        return jsonify(plan_production(lines))
+    except Exception as e:
+        print(f"Ошибка при планировании: {str(e)}")
+        return jsonify({'error': f'Ошибка при планировании: {str(e)}'}), 500
+
+@app.route('/jobs', methods=['GET', 'POST'])
+def job_list():
+    if request.method == 'GET':
+        return jsonify({'jobs': [job_json(job) for job in job_store().recent()]})
     
-    # Создаем базу данных при первом запуске
-    with app.app_context():
-        db.create_all()
+    # Задача принимается JSON-объектом {"kind": ..., "params": {...}};
+    # строки пакетного расчета можно передать CSV-файлом в поле "file"
+    if 'file' in request.files:
+        kind = request.form.get('kind', 'material_batch')
+        try:
+            params = {'lines': parse_order_lines_csv(request.files['file'].stream)}
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({'error': 'Ожидается JSON-объект с полем kind'}), 400
+        kind = payload.get('kind')
+        params = payload.get('params') or {}
     
-    app.run(debug=True)
\ No newline at end of file
+    if not isinstance(params, dict):
+        return jsonify({'error': 'Поле params должно быть объектом'}), 400
+    try:
+        job = submit_job(kind, params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(job_json(job)), 202, {'Location': url_for('job_status', job_id=job['id'])}
+
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    job = job_store().get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job_json(job, include_result=request.args.get('result') == '1'))
+
+@app.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    store = job_store()
+    job = store.get(job_id)
+    if job is None:
+        abort(404)
+    if job['status'] in FINISHED_STATUSES:
+        return jsonify({'error': 'Задача уже завершена', 'job': job_json(job)}), 409
+    return jsonify(job_json(store.cancel(job_id))), 202
+
+if __name__ == '__main__':
+    # Таблицы создаются отдельно: python init_db.py --create-tables
+    app.run(debug=True)
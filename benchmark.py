@@ -0,0 +1,284 @@
+import argparse
+import contextlib
+import csv
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# Файлы импорта, которые генерирует benchmark (в формате CSV, см. init_db.find_source)
+PRODUCT_TYPES = [('Гостиные', 3.5), ('Прихожие', 5.6), ('Мягкая мебель', 3.0),
+                 ('Кровати', 4.7), ('Шкафы', 1.5), ('Комоды', 2.3)]
+MATERIAL_TYPES = [('Мебельный щит из массива дерева', '0.80%'), ('Ламинированное ДСП', '0.70%'),
+                  ('Фанера', '0.55%'), ('МДФ', '0.30%')]
+# Запуск процесса: веб-приложение и командная строка импорта
+STARTUP_SCENARIOS = {'startup_web': 'app', 'startup_cli': 'init_db'}
+# Модули, которые командная строка не должна загружать при старте
+HEAVY_MODULES = ('pandas', 'numpy', 'openpyxl', 'flask_wtf')
+
+
+def write_csv(path, header, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def generate_catalog(data_dir, products, workshops, workshops_per_product, seed=1):
+    """Генерирует синтетические файлы импорта заданного размера"""
+    rng = random.Random(seed)
+    workshop_names = [f'Цех {number}' for number in range(1, workshops + 1)]
+
+    write_csv(os.path.join(data_dir, 'Product_type_import.csv'),
+              ['Тип продукции', 'Коэффициент типа продукции'], PRODUCT_TYPES)
+    write_csv(os.path.join(data_dir, 'Material_type_import.csv'),
+              ['Тип материала', 'Процент потерь сырья'], MATERIAL_TYPES)
+    write_csv(os.path.join(data_dir, 'Workshops_import.csv'),
+              ['Название цеха', 'Тип цеха', 'Количество человек для производства'],
+              [(name, 'Обработка', rng.randint(3, 10)) for name in workshop_names])
+
+    product_rows = []
+    link_rows = []
+    for number in range(1, products + 1):
+        name = f'Изделие {number:07d}'
+        product_rows.append((rng.choice(PRODUCT_TYPES)[0], name, f'{1000000 + number}',
+                             rng.randint(5000, 250000), rng.choice(MATERIAL_TYPES)[0]))
+        for workshop in rng.sample(workshop_names, min(workshops_per_product, workshops)):
+            link_rows.append((name, workshop, round(rng.uniform(0.5, 5.0), 1)))
+
+    write_csv(os.path.join(data_dir, 'Products_import.csv'),
+              ['Тип продукции', 'Наименование продукции', 'Артикул', 'Минимальная стоимость для партнера',
+               'Основной материал'], product_rows)
+    write_csv(os.path.join(data_dir, 'Product_workshops_import.csv'),
+              ['Наименование продукции', 'Название цеха', 'Время изготовления, ч'], link_rows)
+
+
+class QueryCounter:
+    """Считает SQL-запросы, выполненные движком"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'after_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(name, action, iterations, counter, before=None):
+    """Запускает сценарий: задержки по перцентилям, запросы к БД за вызов и пик памяти"""
+    latencies = []
+    queries = []
+    # Отладочный вывод сервисов не засоряет отчет, но его стоимость остается в замерах
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(iterations):
+            if before:
+                before()
+            counter.count = 0
+            started = time.perf_counter()
+            action()
+            latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(counter.count)
+
+        # Память меряем отдельным прогоном: tracemalloc сильно замедляет код
+        if before:
+            before()
+        tracemalloc.start()
+        action()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    result = {
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p90_ms': round(percentile(latencies, 0.9), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(statistics.mean(latencies), 3),
+        'queries': max(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+    print(f"  {name}: p50 {result['p50_ms']} мс, p99 {result['p99_ms']} мс, "
+          f"запросов {result['queries']}, память {result['peak_memory_kb']} КБ")
+    return result
+
+
+def check_status(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.request.path}: статус {response.status_code}")
+    return response
+
+
+def run_size(size, args, data_dir):
+    from app import app
+    from models import db, Product
+    from cache import response_cache, material_results
+    import init_db
+    import services
+    import planner
+
+    print(f"Каталог из {size} продуктов:")
+    generate_catalog(data_dir, size, args.workshops, args.workshops_per_product)
+
+    results = {}
+    started = time.perf_counter()
+    tracemalloc.start()
+    init_db.import_data(data_dir=data_dir)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    elapsed = time.perf_counter() - started
+    results['import_data'] = {'seconds': round(elapsed, 3), 'rows_per_second': round(size / elapsed, 1),
+                              'peak_memory_kb': round(peak / 1024, 1)}
+    print(f"  import_data: {elapsed:.2f} с")
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    rng = random.Random(size)
+
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+        product_ids = [row[0] for row in db.session.query(Product.id)]
+        articles = [row[0] for row in db.session.query(Product.article).limit(1000)]
+    last_page = client.get('/products', query_string={'format': 'json', 'sort': 'time'}).get_json()
+
+    scenarios = {
+        'products_page': lambda: check_status(client.get('/products')),
+        'products_page_cached': lambda: check_status(client.get('/products')),
+        'products_next_page_by_time': lambda: check_status(client.get('/products', query_string={
+            'sort': 'time', 'cursor': last_page['next_cursor'] or ''})),
+        'products_json': lambda: check_status(client.get('/products', query_string={'format': 'json', 'per_page': 500})),
+        'product_workshops': lambda: check_status(client.get(f'/product/workshops/{rng.choice(product_ids)}')),
+        'material_calculator_get': lambda: check_status(client.get('/material-calculator')),
+        'material_calculator_post': lambda: check_status(client.post('/material-calculator', data={
+            'product_type_id': 1, 'material_type_id': 1, 'quantity': 10, 'param1': '2.5', 'param2': '1.2'})),
+        'planner_json': lambda: check_status(client.post('/planner/plan', json=[
+            {'article': rng.choice(articles), 'quantity': rng.randint(1, 100)} for _ in range(1000)])),
+    }
+    for name, action in scenarios.items():
+        before = None if name.endswith('_cached') else response_cache.clear
+        results[name] = measure(name, action, args.requests, counter, before)
+
+    batch_lines = [{'product_type_id': rng.randint(1, len(PRODUCT_TYPES)),
+                    'material_type_id': rng.randint(1, len(MATERIAL_TYPES)),
+                    'quantity': rng.randint(1, 100), 'param1': 2.0, 'param2': 1.5} for _ in range(1000)]
+    # Строки калькулятора из небольшого набора типовых размеров, как при работе менеджеров
+    sizes = [(rng.choice([0.6, 0.8, 1.0, 1.2, 1.5, 2.0]), rng.choice([0.4, 0.5, 0.6, 1.0, 2.0])) for _ in range(20)]
+    calculator_inputs = [(rng.randint(1, len(PRODUCT_TYPES)), rng.randint(1, len(MATERIAL_TYPES)),
+                          rng.choice([1, 5, 10, 50, 100]), *rng.choice(sizes)) for _ in range(5000)]
+    with app.app_context():
+        service_scenarios = {
+            'service_raw_material_memoized': lambda: services.calculate_raw_material(*rng.choice(calculator_inputs)),
+            'service_production_time': lambda: services.calculate_production_time(rng.choice(product_ids)),
+            'service_products_page': lambda: services.get_products_page(sort='cost', per_page=50),
+            'service_raw_material_batch_1000': lambda: services.calculate_raw_material_batch(batch_lines),
+            'service_plan_production_1000': lambda: planner.plan_production(
+                [{'article': rng.choice(articles), 'quantity': rng.randint(1, 100)} for _ in range(1000)]),
+        }
+        hits, misses = material_results.hits, material_results.misses
+        for name, action in service_scenarios.items():
+            results[name] = measure(name, action, args.requests, counter)
+        calls = material_results.hits - hits + material_results.misses - misses
+        hit_rate = (material_results.hits - hits) / calls if calls else 0.0
+        results['service_raw_material_memoized']['hit_rate'] = round(hit_rate, 3)
+        print(f"  Доля попаданий в кэш калькулятора: {hit_rate:.1%}")
+    return results
+
+
+def measure_startup(iterations):
+    """Время от запуска нового процесса Python до импорта приложения и тяжелые модули, загруженные при этом"""
+    results = {}
+    code = "import sys, {module}; print(','.join(name for name in %r if name in sys.modules))" % (HEAVY_MODULES,)
+    for name, module in STARTUP_SCENARIOS.items():
+        latencies = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            output = subprocess.check_output([sys.executable, '-c', code.format(module=module)], text=True,
+                                             cwd=os.path.dirname(os.path.abspath(__file__)))
+            latencies.append((time.perf_counter() - started) * 1000)
+        results[name] = {
+            'iterations': iterations,
+            'p50_ms': round(percentile(latencies, 0.5), 3),
+            'p90_ms': round(percentile(latencies, 0.9), 3),
+            'heavy_modules': [module for module in output.strip().split(',') if module],
+        }
+        print(f"  {name}: p50 {results[name]['p50_ms']} мс, загружены {results[name]['heavy_modules'] or 'только нужные модули'}")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path, tolerance):
+    """Печатает изменение медианной задержки относительно сохраненного прогона"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"Сравнение с {baseline_path} (коммит {baseline.get('commit')}):")
+    for size, scenarios in current['results'].items():
+        for name, result in scenarios.items():
+            old = baseline.get('results', {}).get(size, {}).get(name)
+            if not old or 'p50_ms' not in result or not old.get('p50_ms'):
+                continue
+            ratio = result['p50_ms'] / old['p50_ms']
+            mark = ' <- регрессия' if ratio > 1 + tolerance else ''
+            print(f"  {size} {name}: {old['p50_ms']} -> {result['p50_ms']} мс ({ratio:.2f}x){mark}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочные замеры маршрутов, импорта и сервисов на синтетических данных')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='размеры каталога (количество продуктов)')
+    parser.add_argument('--workshops', type=int, default=30, help='количество цехов')
+    parser.add_argument('--workshops-per-product', type=int, default=6, help='цехов на один продукт')
+    parser.add_argument('--requests', type=int, default=30, help='повторов каждого сценария')
+    parser.add_argument('--startup-runs', type=int, default=10, help='запусков процесса для замера времени старта')
+    parser.add_argument('--database-url', default=None,
+                        help='БД для замеров (по умолчанию временный файл SQLite); данные в ней будут удалены')
+    parser.add_argument('--output', default='benchmark_results.json', help='файл для сохранения результатов')
+    parser.add_argument('--compare', default=None, help='сравнить с результатами предыдущего прогона')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимый рост задержки при сравнении')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        # URL БД нужно задать до импорта приложения: Config читает его при загрузке
+        os.environ['DATABASE_URL'] = args.database_url or 'sqlite:///' + os.path.join(data_dir, 'benchmark.sqlite')
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from app import app
+        from models import db
+        with app.app_context():
+            db.create_all()
+
+        report = {
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'database': os.environ['DATABASE_URL'].split(':', 1)[0],
+            'python': sys.version.split()[0],
+            'results': {},
+        }
+        print("Запуск процесса:")
+        report['results']['startup'] = measure_startup(args.startup_runs)
+        for size in args.sizes:
+            report['results'][str(size)] = run_size(size, args, data_dir)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.output}")
+
+    if args.compare:
+        compare(report, args.compare, args.tolerance)
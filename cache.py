@@ -0,0 +1,316 @@
+from models import db, ProductType, MaterialType, Workshop, DataVersion
+from flask import request, session, current_app, Response, make_response, g
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+from collections import namedtuple, OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+import hashlib
+import threading
+
+# Неизменяемые копии строк справочников: их можно безопасно отдавать
+# в разные запросы, они не привязаны к сессии SQLAlchemy
+ProductTypeRow = namedtuple('ProductTypeRow', 'id name coefficient')
+MaterialTypeRow = namedtuple('MaterialTypeRow', 'id name waste_percentage')
+WorkshopRow = namedtuple('WorkshopRow', 'id name worker_count')
+
+REFERENCE_MODELS = (ProductType, MaterialType, Workshop)
+# Количество запоминаемых результатов калькулятора сырья
+MATERIAL_RESULTS_SIZE = 10000
+REFERENCE_TABLES = {model.__tablename__ for model in REFERENCE_MODELS}
+# Строки data_versions: версия каталога (любая запись продукции) и версия справочников
+CATALOG_VERSION_ID = 1
+REFERENCE_VERSION_ID = 2
+
+
+class ReferenceCache:
+    """Кэш справочников (типы продукции, типы материалов, цеха) в памяти процесса.
+
+    Данные загружаются при первом обращении. Записи этого процесса сбрасывают кэш событиями
+    сессии, а импорт и записи других процессов обнаруживаются по версии справочников
+    (строка REFERENCE_VERSION_ID в data_versions), которая сверяется раз за контекст приложения
+    (запрос, фоновая задача). Правки продукции эту версию не меняют и кэш не сбрасывают.
+    Каждая инвалидация увеличивает номер версии."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self.version = 0
+        self.reference_version = None
+
+    def _load(self):
+        product_types = [ProductTypeRow(*row) for row in
+                         db.session.query(ProductType.id, ProductType.name, ProductType.coefficient)
+                         .order_by(ProductType.name)]
+        material_types = [MaterialTypeRow(*row) for row in
+                          db.session.query(MaterialType.id, MaterialType.name, MaterialType.waste_percentage)
+                          .order_by(MaterialType.name)]
+        workshops = [WorkshopRow(*row) for row in
+                     db.session.query(Workshop.id, Workshop.name, Workshop.worker_count)
+                     .order_by(Workshop.name)]
+        # Множитель сырья на единицу площади для каждой пары (тип продукции, материал):
+        # коэффициент типа * (1 + процент потерь)
+        multipliers = {(product_type.id, material_type.id):
+                       float(product_type.coefficient) * (1.0 + float(material_type.waste_percentage))
+                       for product_type in product_types if product_type.coefficient is not None
+                       for material_type in material_types if material_type.waste_percentage is not None}
+        return {
+            'product_types': product_types,
+            'material_types': material_types,
+            'workshops': workshops,
+            'product_types_by_id': {row.id: row for row in product_types},
+            'material_types_by_id': {row.id: row for row in material_types},
+            'workshops_by_id': {row.id: row for row in workshops},
+            'material_multipliers': multipliers,
+        }
+
+    def ensure_current(self):
+        if g.get('reference_data_checked'):
+            return
+        g.reference_data_checked = True
+        version = get_reference_version()
+        if version != self.reference_version:
+            self.invalidate(version)
+
+    def _get(self, key):
+        self.ensure_current()
+        data = self._data
+        if data is None:
+            with self._lock:
+                if self._data is None:
+                    self._data = self._load()
+                data = self._data
+        return data[key]
+
+    def product_types(self):
+        return self._get('product_types')
+
+    def material_types(self):
+        return self._get('material_types')
+
+    def workshops(self):
+        return self._get('workshops')
+
+    def product_type(self, product_type_id):
+        return self._get('product_types_by_id').get(product_type_id)
+
+    def material_type(self, material_type_id):
+        return self._get('material_types_by_id').get(material_type_id)
+
+    def workshops_by_id(self):
+        return self._get('workshops_by_id')
+
+    def material_multiplier(self, product_type_id, material_type_id):
+        return self._get('material_multipliers').get((product_type_id, material_type_id))
+
+    def invalidate(self, reference_version=None):
+        with self._lock:
+            self._data = None
+            self.version += 1
+            if reference_version is not None:
+                self.reference_version = reference_version
+        material_results.clear()
+
+
+class ResultCache:
+    """LRU-кэш результатов расчетов с ограничением по количеству записей и счетчиками попаданий"""
+
+    _missing = object()
+
+    def __init__(self, max_size):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Возвращает (найдено ли значение, значение)"""
+        with self._lock:
+            value = self._entries.get(key, self._missing)
+            if value is self._missing:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+material_results = ResultCache(MATERIAL_RESULTS_SIZE)
+
+
+reference_cache = ReferenceCache()
+
+
+# Инвалидация при записи справочников: изменения собираются во время flush
+# и массовых INSERT/UPDATE/DELETE, а кэш сбрасывается только после commit
+@event.listens_for(Session, 'after_flush')
+def _track_reference_flush(session, flush_context):
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, REFERENCE_MODELS):
+            session.info['reference_data_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_reference_statements(orm_execute_state):
+    if orm_execute_state.is_select:
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if getattr(table, 'name', None) in REFERENCE_TABLES:
+        orm_execute_state.session.info['reference_data_changed'] = True
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_reference_version(session):
+    # commit выполняет последний flush уже после этого события, поэтому делаем его сами
+    session.flush()
+    if session.info.get('reference_data_changed') and 'reference_version' not in session.info:
+        bump_reference_version()
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_reference_cache(session):
+    changed = session.info.pop('reference_data_changed', False)
+    version = session.info.pop('reference_version', None)
+    if changed or version is not None:
+        reference_cache.invalidate(version)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_reference_changes(session):
+    session.info.pop('reference_data_changed', None)
+    session.info.pop('reference_version', None)
+
+
+def get_data_version():
+    """Текущая версия данных каталога и время ее изменения"""
+    row = db.session.query(DataVersion.version, DataVersion.changed_at)\
+        .filter(DataVersion.id == CATALOG_VERSION_ID).first()
+    if row is None:
+        return 0, None
+    return row.version, row.changed_at
+
+
+def get_reference_version():
+    """Текущая версия справочников"""
+    return db.session.query(DataVersion.version).filter(DataVersion.id == REFERENCE_VERSION_ID).scalar() or 0
+
+
+def _bump_version(version_id):
+    now = datetime.utcnow()
+    updated = db.session.execute(update(DataVersion)
+                                 .where(DataVersion.id == version_id)
+                                 .values(version=DataVersion.version + 1, changed_at=now)).rowcount
+    if not updated:
+        db.session.add(DataVersion(id=version_id, version=1, changed_at=now))
+        db.session.flush()
+    # Строка версии заблокирована UPDATE до конца транзакции, поэтому значение точное
+    return db.session.query(DataVersion.version).filter(DataVersion.id == version_id).scalar()
+
+
+def bump_data_version():
+    """Увеличивает версию данных в текущей транзакции; вызывается перед commit любой записи каталога"""
+    # Новая версия нужна индексу поиска, чтобы после commit понять, что пропущенных изменений нет
+    db.session.info['data_version'] = _bump_version(CATALOG_VERSION_ID)
+
+
+def bump_reference_version():
+    """Увеличивает версию справочников в текущей транзакции. Записи справочников через сессию
+    отмечаются событиями сами; явный вызов нужен загрузке в обход сессии (COPY при импорте)."""
+    db.session.info['reference_version'] = _bump_version(REFERENCE_VERSION_ID)
+
+
+class ResponseCache:
+    """LRU-кэш готовых ответов с ограничением по суммарному размеру тел"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype, max_bytes):
+        if len(body) > max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._entries[key] = (body, mimetype)
+            self.size += len(body)
+            while self.size > max_bytes:
+                _, (evicted_body, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted_body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+response_cache = ResponseCache()
+
+
+def cached_view(view):
+    """Кэширует GET-ответ страницы до следующего изменения данных и поддерживает условные запросы
+    (If-None-Match / If-Modified-Since -> 304)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Страница с flash-сообщением персональна для пользователя, ее не кэшируем
+        if request.method != 'GET' or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        version, changed_at = get_data_version()
+        key = (request.full_path, version)
+        etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        last_modified = changed_at.replace(microsecond=0, tzinfo=timezone.utc) if changed_at else None
+
+        not_modified = request.if_none_match.contains(etag)
+        if not request.if_none_match and last_modified and request.if_modified_since:
+            not_modified = request.if_modified_since >= last_modified
+        if not_modified:
+            response = Response(status=304)
+        else:
+            entry = response_cache.get(key)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+                entry = (response.get_data(), response.mimetype)
+                response_cache.put(key, entry[0], entry[1], current_app.config['RESPONSE_CACHE_MAX_BYTES'])
+            response = Response(entry[0], mimetype=entry[1])
+
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        # Браузер хранит страницу, но перед показом сверяет версию с сервером
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
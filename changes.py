@@ -0,0 +1,159 @@
+from models import db, Product, ProductWorkshop, ProductChange
+from cache import bump_data_version
+from sqlalchemy import event, inspect, select, and_
+from sqlalchemy.orm import Session
+from datetime import datetime
+
+# Записей журнала в одном пакетном INSERT
+CHANGES_BATCH_SIZE = 5000
+# Служебные поля: их изменение само по себе не попадает в журнал
+IGNORED_FIELDS = ('created_at', 'updated_at')
+# Состояние продукта, которое лента отдает вместе с изменением
+FEED_COLUMNS = (Product.article, Product.name, Product.description, Product.product_type_id,
+                Product.main_material_id, Product.min_cost_for_partner, Product.parameter1,
+                Product.parameter2, Product.production_time, Product.updated_at)
+
+
+def _merge(pending, product_id, article, operation, fields):
+    """Объединяет изменения одного продукта в пределах транзакции"""
+    current = pending.get(product_id)
+    if current is not None:
+        current_article, current_operation, current_fields = current
+        if operation == 'update':
+            if current_operation == 'delete':
+                return
+            if current_operation == 'insert':
+                fields = None
+                operation = 'insert'
+            elif current_fields is None or fields is None:
+                fields = None
+            else:
+                fields = current_fields | set(fields)
+            article = article or current_article
+    pending[product_id] = (article, operation, set(fields) if fields else None)
+
+
+def record_product_changes(session, products, operation, fields=None):
+    """Отмечает изменения продукции, сделанные в обход flush (массовые операции, импорт).
+    products - пары (id, артикул); пустой артикул заполняется при записи журнала в commit."""
+    pending = session.info.setdefault('product_changes', {})
+    for product_id, article in products:
+        _merge(pending, product_id, article, operation, fields)
+
+
+def record_catalog_reset(session):
+    """Каталог очищен и загружается заново: потребители ленты должны сбросить свою копию,
+    все продукты придут следом как insert"""
+    session.info['product_changes'] = {None: (None, 'reset', None)}
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_product_changes(session, flush_context):
+    pending = session.info.setdefault('product_changes', {})
+    for instance in session.new:
+        if isinstance(instance, Product):
+            _merge(pending, instance.id, instance.article, 'insert', None)
+        elif isinstance(instance, ProductWorkshop):
+            _merge(pending, instance.product_id, None, 'update', ['workshops'])
+
+    for instance in session.dirty:
+        if isinstance(instance, Product):
+            attrs = inspect(instance).attrs
+            fields = [column.key for column in inspect(Product).column_attrs
+                      if column.key not in IGNORED_FIELDS and attrs[column.key].history.has_changes()]
+            if fields:
+                _merge(pending, instance.id, instance.article, 'update', fields)
+        elif isinstance(instance, ProductWorkshop):
+            attrs = inspect(instance).attrs
+            if not any(attrs[column.key].history.has_changes() for column in inspect(ProductWorkshop).column_attrs):
+                continue
+            # Связь могли перенести на другой продукт - изменились оба
+            for product_id in {instance.product_id, *attrs.product_id.history.deleted}:
+                _merge(pending, product_id, None, 'update', ['workshops'])
+
+    for instance in session.deleted:
+        if isinstance(instance, Product):
+            _merge(pending, instance.id, instance.article, 'delete', None)
+        elif isinstance(instance, ProductWorkshop):
+            _merge(pending, instance.product_id, None, 'update', ['workshops'])
+
+
+@event.listens_for(Session, 'before_commit')
+def _write_product_changes(session):
+    # commit выполняет последний flush уже после этого события, поэтому делаем его сами
+    session.flush()
+    pending = session.info.pop('product_changes', None)
+    if not pending:
+        return
+
+    # Версия данных берется до вставки журнала: строка версии заблокирована до конца транзакции,
+    # поэтому id записей журнала выдаются в порядке commit и курсор ленты ничего не пропускает
+    if 'data_version' not in session.info:
+        bump_data_version()
+    version = session.info['data_version']
+
+    missing = [product_id for product_id, (article, operation, _) in pending.items()
+               if product_id is not None and article is None and operation != 'delete']
+    articles = {}
+    for start in range(0, len(missing), CHANGES_BATCH_SIZE):
+        articles.update(session.execute(select(Product.id, Product.article)
+                                        .where(Product.id.in_(missing[start:start + CHANGES_BATCH_SIZE]))).all())
+
+    now = datetime.utcnow()
+    rows = [{'product_id': product_id, 'article': article or articles.get(product_id), 'operation': operation,
+             'fields': ','.join(sorted(fields)) if fields else None, 'version': version, 'changed_at': now}
+            for product_id, (article, operation, fields) in pending.items()]
+    connection = session.connection()
+    for start in range(0, len(rows), CHANGES_BATCH_SIZE):
+        connection.execute(ProductChange.__table__.insert(), rows[start:start + CHANGES_BATCH_SIZE])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_product_changes(session):
+    session.info.pop('product_changes', None)
+
+
+def get_changes(since=0, limit=500):
+    """Изменения продукции после курсора since в порядке фиксации. Для insert и update
+    к записи добавляется текущее состояние продукта, для delete и reset оно пустое."""
+    rows = db.session.execute(
+        select(ProductChange, *FEED_COLUMNS)
+        .outerjoin(Product, and_(Product.id == ProductChange.product_id, ProductChange.operation != 'delete'))
+        .where(ProductChange.id > since)
+        .order_by(ProductChange.id)
+        .limit(limit + 1)
+    ).all()
+
+    changes = []
+    for row in rows[:limit]:
+        change = row.ProductChange
+        product = None
+        if row.article is not None:
+            product = {
+                'article': row.article,
+                'name': row.name,
+                'description': row.description,
+                'product_type_id': row.product_type_id,
+                'main_material_id': row.main_material_id,
+                'min_cost_for_partner': float(row.min_cost_for_partner),
+                'parameter1': float(row.parameter1 or 0),
+                'parameter2': float(row.parameter2 or 0),
+                'production_time': float(row.production_time or 0),
+                'updated_at': row.updated_at.isoformat() if row.updated_at else None,
+            }
+        changes.append({
+            'id': change.id,
+            'product_id': change.product_id,
+            'article': change.article,
+            'operation': change.operation,
+            'fields': change.fields.split(',') if change.fields else None,
+            'version': change.version,
+            'changed_at': change.changed_at.isoformat(),
+            'product': product,
+        })
+
+    return {
+        'changes': changes,
+        'next_cursor': changes[-1]['id'] if changes else since,
+        'has_more': len(rows) > limit,
+    }
@@ -2,5 +2,35 @@ import os
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here'
-    SQLALCHEMY_DATABASE_URI = 'TOP_SECRET'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'TOP_SECRET'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Размер страницы каталога продукции
+    PRODUCTS_PER_PAGE = 50
+    PRODUCTS_MAX_PER_PAGE = 500
+    # Объем памяти под кэш готовых страниц каталога, байт
+    RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    # Сбор метрик: порог медленного SQL-запроса, мс, файл журнала медленных запросов
+    # и число повторов одного запроса за HTTP-запрос, после которого он считается N+1
+    METRICS_SLOW_QUERY_MS = 100
+    METRICS_SLOW_QUERY_LOG = 'slow_queries.log'
+    METRICS_N_PLUS_ONE_THRESHOLD = 10
+    # Поиск продукции: 'auto' - индексы PostgreSQL (pg_trgm, tsvector), если расширение установлено,
+    # иначе индекс в памяти процесса; 'memory' или 'postgresql' - принудительно
+    SEARCH_BACKEND = 'auto'
+    SEARCH_RESULTS_LIMIT = 50
+    # Лента изменений продукции /changes: записей на страницу по умолчанию и максимум
+    CHANGES_PER_PAGE = 500
+    CHANGES_MAX_PER_PAGE = 5000
+    # Асинхронный API (api.py): отдельный URL подключения (по умолчанию SQLALCHEMY_DATABASE_URI
+    # с асинхронным драйвером) и пул соединений на один процесс. При нескольких процессах
+    # (pool_size + max_overflow) * процессы не должно превышать max_connections PostgreSQL
+    API_DATABASE_URL = os.environ.get('API_DATABASE_URL')
+    API_POOL_SIZE = 20
+    API_MAX_OVERFLOW = 10
+    API_POOL_TIMEOUT = 5
+    API_POOL_RECYCLE = 1800
+    # Фоновые задачи: таблица задач в отдельной базе (по умолчанию SQLite в каталоге instance),
+    # количество процессов-исполнителей и каталог, из которого разрешен импорт файлов
+    SQLALCHEMY_BINDS = {'jobs': os.environ.get('JOBS_DATABASE_URL') or 'sqlite:///jobs.sqlite'}
+    JOBS_MAX_WORKERS = 2
+    JOBS_IMPORT_ROOT = os.environ.get('JOBS_IMPORT_ROOT') or '.'
@@ -0,0 +1,25 @@
+from flask import Flask, has_app_context
+from models import db
+from config import Config
+from contextlib import nullcontext
+
+_app = None
+
+
+def create_app(import_name=__name__, config_object=Config):
+    """Приложение с настройками и подключением к БД, без маршрутов, форм и метрик.
+    Веб-часть добавляет app.py; импорт данных и фоновые задачи обходятся этим минимумом."""
+    app = Flask(import_name)
+    app.config.from_object(config_object)
+    db.init_app(app)
+    return app
+
+
+def app_context():
+    """Текущий контекст приложения, если он уже есть, иначе контекст минимального приложения"""
+    global _app
+    if has_app_context():
+        return nullcontext()
+    if _app is None:
+        _app = create_app()
+    return _app.app_context()
@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, DecimalField, IntegerField, SelectField, TextAreaField
 from wtforms.validators import DataRequired, NumberRange, ValidationError
-from models import ProductType, MaterialType, db
+from cache import reference_cache
 
 def validate_positive(form, field):
     if field.data is not None and field.data <= 0:
@@ -24,8 +24,8 @@ class ProductForm(FlaskForm):
     
     def __init__(self, *args, **kwargs):
         super(ProductForm, self).__init__(*args, **kwargs)
-        self.product_type_id.choices = [(pt.id, pt.name) for pt in ProductType.query.all()]
-        self.main_material_id.choices = [(mt.id, mt.name) for mt in MaterialType.query.all()]
+        self.product_type_id.choices = [(pt.id, pt.name) for pt in reference_cache.product_types()]
+        self.main_material_id.choices = [(mt.id, mt.name) for mt in reference_cache.material_types()]
 
 class MaterialCalculatorForm(FlaskForm):
     product_type_id = SelectField('Тип продукции', coerce=int, validators=[DataRequired()])
@@ -36,5 +36,8 @@ class MaterialCalculatorForm(FlaskForm):
     
     def __init__(self, *args, **kwargs):
         super(MaterialCalculatorForm, self).__init__(*args, **kwargs)
-        self.product_type_id.choices = [(pt.id, pt.name) for pt in ProductType.query.order_by(ProductType.name).all()]
-        self.material_type_id.choices = [(mt.id, mt.name) for mt in MaterialType.query.order_by(MaterialType.name).all()]
\ No newline at end of file
+        self.product_type_id.choices = [(pt.id, pt.name) for pt in reference_cache.product_types()]
+        self.material_type_id.choices = [(mt.id, mt.name) for mt in reference_cache.material_types()]
+
+class PlannerForm(FlaskForm):
+    order = TextAreaField('Заказ (по строке: артикул количество)', validators=[DataRequired()])
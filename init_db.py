@@ -1,128 +1,547 @@
-import pandas as pd
-from app import app, db
-from models import ProductType, MaterialType, Workshop, Product, ProductWorkshop
+from factory import app_context
+from models import db, ProductType, MaterialType, Workshop, Product, ProductWorkshop
+from cache import bump_data_version, bump_reference_version
+from changes import record_product_changes, record_catalog_reset
+from services import refresh_production_times, reconcile_production_times
+from sqlalchemy import update, tuple_
+from datetime import datetime
+import argparse
+import csv
+import io
+import json
+import math
+import os
 import re
+import time
 
-def import_data():
-    with app.app_context():
-        # Очистка существующих данных
-        print("Очистка существующих данных...")
-        db.session.query(ProductWorkshop).delete()
-        db.session.query(Product).delete()
-        db.session.query(Workshop).delete()
-        db.session.query(MaterialType).delete()
-        db.session.query(ProductType).delete()
-        db.session.commit()
-        
-        # Импорт типов продукции
-        print("Импорт типов продукции...")
-        product_types_df = pd.read_excel('Product_type_import.xlsx')
-        for _, row in product_types_df.iterrows():
-            pt = ProductType(
-                name=row['Тип продукции'],
-                coefficient=float(row['Коэффициент типа продукции'])
-            )
-            db.session.add(pt)
-        db.session.commit()
-        
-        # Импорт типов материалов
-        print("Импорт типов материалов...")
-        material_types_df = pd.read_excel('Material_type_import.xlsx')
-        for _, row in material_types_df.iterrows():
-            # Обработка процента потерь: конвертируем "0.80%" в 0.008
-            waste_str = str(row['Процент потерь сырья']).strip()
-            
-            # Извлекаем числовое значение из строки
-            match = re.search(r'[\d.,]+', waste_str)
-            if match:
-                # Заменяем запятую на точку для корректного преобразования
-                waste_value = match.group().replace(',', '.')
-                waste_percent = float(waste_value)
-                
-                # Если значение больше 1, это вероятно проценты (0.80 -> 0.8%)
-                # Если значение меньше 1, это уже десятичная дробь (0.008)
-                if waste_percent >= 1:
-                    waste_decimal = waste_percent / 100.0
-                else:
-                    waste_decimal = waste_percent
-                
-                # Если значение в пределах 0-10, считаем, что это проценты
-                if 0 < waste_percent <= 10:
-                    waste_decimal = waste_percent / 100.0
-            else:
-                waste_decimal = 0.0
-            
-            print(f"Материал: {row['Тип материала']}, исходное значение: '{waste_str}', итоговое значение: {waste_decimal}")
-            
-            mt = MaterialType(
-                name=row['Тип материала'],
-                waste_percentage=waste_decimal
-            )
-            db.session.add(mt)
-        db.session.commit()
-        
-        # Импорт цехов
-        print("Импорт цехов...")
-        workshops_df = pd.read_excel('Workshops_import.xlsx')
-        workshop_names = workshops_df['Название цеха'].unique()
-        
-        for name in workshop_names:
-            name_clean = str(name).strip()
-            if not name_clean:
-                continue
-                
-            w = Workshop(
-                name=name_clean,
-                worker_count=5  # Стандартное количество работников
-            )
-            db.session.add(w)
-        db.session.commit()
-        
-        # Импорт продукции
-        print("Импорт продукции...")
-        products_df = pd.read_excel('Products_import.xlsx')
-        
-        for _, row in products_df.iterrows():
-            # Находим соответствующие типы
-            product_type = ProductType.query.filter_by(name=row['Тип продукции']).first()
-            material_type = MaterialType.query.filter_by(name=row['Основной материал']).first()
-            
-            if product_type and material_type:
-                p = Product(
-                    article=str(row['Артикул']),
-                    product_type_id=product_type.id,
-                    name=row['Наименование продукции'],
-                    min_cost_for_partner=float(row['Минимальная стоимость для партнера']),
-                    main_material_id=material_type.id,
-                    parameter1=1.0,  # Значение по умолчанию
-                    parameter2=1.0   # Значение по умолчанию
-                )
-                db.session.add(p)
-        db.session.commit()
-        
-        # Импорт связей продукции и цехов
-        print("Импорт связей продукции и цехов...")
-        product_workshops_df = pd.read_excel('Product_workshops_import.xlsx')
-        
-        for _, row in product_workshops_df.iterrows():
-            # Находим продукт и цех
-            product_name = row['Наименование продукции']
-            workshop_name = row['Название цеха']
-            
-            product = Product.query.filter_by(name=product_name).first()
-            workshop = Workshop.query.filter_by(name=workshop_name).first()
-            
-            if product and workshop:
-                time_in_workshop = float(row['Время изготовления, ч'])
-                pw = ProductWorkshop(
-                    product_id=product.id,
-                    workshop_id=workshop.id,
-                    time_in_workshop=time_in_workshop,
-                    worker_count=3  # Стандартное количество работников
-                )
-                db.session.add(pw)
+# Количество строк в одном пакетном INSERT/UPDATE
+IMPORT_BATCH_SIZE = 5000
+
+# Количество строк файла, фиксируемых одной транзакцией в потоковом режиме
+IMPORT_CHUNK_SIZE = 10000
+
+# Файл с позициями последних зафиксированных пакетов потокового импорта
+CHECKPOINT_FILE = 'import_checkpoint.json'
+
+
+class RejectedRow(Exception):
+    """Строка файла не прошла проверку и не будет импортирована"""
+
+
+class ImportReport:
+    """Статистика импорта одной таблицы"""
+
+    def __init__(self, title):
+        self.title = title
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def reject(self, row_number, reason):
+        self.rejected.append((row_number, reason))
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        rate = self.read / self.elapsed if self.elapsed > 0 else 0
+        print(f"{self.title}: прочитано {self.read}, вставлено {self.inserted}, "
+              f"обновлено {self.updated}, отклонено {len(self.rejected)} "
+              f"({self.elapsed:.2f} с, {rate:.0f} строк/с)")
+
+
+class ImportCheckpoint:
+    """Номера последних зафиксированных строк по файлам для продолжения потокового импорта"""
+
+    def __init__(self, path=CHECKPOINT_FILE):
+        self.path = path
+        self.positions = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.positions = json.load(f)
+
+    def position(self, source):
+        return self.positions.get(source, {'row': 0, 'done': False})
+
+    def save(self, source, row_number, done=False):
+        self.positions[source] = {'row': row_number, 'done': done}
+        # Пишем во временный файл и переименовываем, чтобы сбой не оставил битый JSON
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.positions, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.positions = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def read_rows(path):
+    """Читает файл импорта целиком и возвращает пары (номер строки в файле, словарь значений)"""
+    # pandas загружается только при импорте, а не при каждом запуске командной строки
+    import pandas as pd
+
+    # Значения читаются как текст, как и при потоковом чтении: иначе pandas превратит артикул 00123 в число 123
+    if path.endswith('.csv'):
+        df = pd.read_csv(path, dtype=str)
+    else:
+        df = pd.read_excel(path, dtype=str)
+    df.columns = [str(column).strip() for column in df.columns]
+    # Первая строка файла - заголовок
+    return enumerate(df.to_dict('records'), start=2)
+
+
+def stream_rows(path):
+    """Построчно читает файл импорта, не загружая его в память целиком"""
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            header = [clean_name(column) for column in next(reader, [])]
+            for row_number, values in enumerate(reader, start=2):
+                if any(values):
+                    yield row_number, dict(zip(header, values))
+        return
+
+    import openpyxl
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [clean_name(column) for column in next(rows, ())]
+        for row_number, values in enumerate(rows, start=2):
+            if any(value is not None for value in values):
+                yield row_number, dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def find_source(data_dir, name):
+    """Путь к файлу импорта: CSV-выгрузка имеет приоритет над книгой Excel с тем же именем"""
+    csv_path = os.path.join(data_dir, name + '.csv')
+    if os.path.exists(csv_path):
+        return csv_path
+    return os.path.join(data_dir, name + '.xlsx')
+
+
+def is_missing(value):
+    # pandas отдает пустые ячейки как NaN
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def clean_name(value):
+    if is_missing(value):
+        return ''
+    return str(value).strip()
+
+
+def clean_article(value):
+    # Excel хранит артикулы как числа: 1549922.0 -> '1549922'
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return clean_name(value)
+
+
+def to_float(value, title):
+    try:
+        if isinstance(value, str):
+            value = value.strip().replace(',', '.')
+        result = float(value)
+    except (TypeError, ValueError):
+        raise RejectedRow(f"некорректное значение '{title}': {value}")
+    if math.isnan(result):
+        raise RejectedRow(f"не заполнено значение '{title}'")
+    return result
+
+
+def parse_waste_percentage(value):
+    """Конвертирует процент потерь из файла ("0.80%", "0,008") в десятичную дробь"""
+    waste_str = str(value).strip()
+
+    # Извлекаем числовое значение из строки
+    match = re.search(r'[\d.,]+', waste_str)
+    if not match:
+        return 0.0
+
+    # Заменяем запятую на точку для корректного преобразования
+    waste_percent = float(match.group().replace(',', '.'))
+
+    # Если значение больше 1, это вероятно проценты (0.80 -> 0.8%)
+    # Если значение меньше 1, это уже десятичная дробь (0.008)
+    if waste_percent >= 1:
+        waste_decimal = waste_percent / 100.0
+    else:
+        waste_decimal = waste_percent
+
+    # Если значение в пределах 0-10, считаем, что это проценты
+    if 0 < waste_percent <= 10:
+        waste_decimal = waste_percent / 100.0
+    return waste_decimal
+
+
+def copy_rows(model, rows):
+    """Загружает строки в таблицу PostgreSQL через COPY"""
+    columns = list(rows[0].keys())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        # Пустое значение без кавычек COPY воспринимает как NULL
+        writer.writerow(['' if row[column] is None else row[column] for column in columns])
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f"COPY {model.__tablename__} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def bulk_insert(model, rows):
+    """Вставляет строки пакетами, на PostgreSQL - одной командой COPY"""
+    if not rows:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        copy_rows(model, rows)
+        return
+
+    table = model.__table__
+    for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+        db.session.execute(table.insert(), rows[start:start + IMPORT_BATCH_SIZE])
+
+
+def existing_ids(model, key_columns, keys):
+    """Словарь ключ -> id для уже существующих строк с указанными ключами"""
+    key_attributes = [getattr(model, column) for column in key_columns]
+    existing = {}
+    for start in range(0, len(keys), IMPORT_BATCH_SIZE):
+        batch = keys[start:start + IMPORT_BATCH_SIZE]
+        query = db.session.query(model.id, *key_attributes)
+        if len(key_attributes) == 1:
+            query = query.filter(key_attributes[0].in_([key[0] for key in batch]))
+        else:
+            query = query.filter(tuple_(*key_attributes).in_(batch))
+        existing.update({tuple(key): row_id for row_id, *key in query})
+    return existing
+
+
+def bulk_upsert(model, key_columns, rows, insert_only=()):
+    """Обновляет существующие строки по ключу, новые вставляет; возвращает (вставлено, обновлено)"""
+    existing = existing_ids(model, key_columns, [tuple(row[column] for column in key_columns) for row in rows])
+
+    inserts = []
+    updates = []
+    for row in rows:
+        key = tuple(row[column] for column in key_columns)
+        if key in existing:
+            values = {column: value for column, value in row.items() if column not in insert_only}
+            values['id'] = existing[key]
+            updates.append(values)
+        else:
+            inserts.append(row)
+
+    bulk_insert(model, inserts)
+    for start in range(0, len(updates), IMPORT_BATCH_SIZE):
+        db.session.execute(update(model), updates[start:start + IMPORT_BATCH_SIZE])
+    return len(inserts), len(updates)
+
+
+def name_index(model):
+    """Словарь название -> id для справочной таблицы"""
+    return {name: row_id for row_id, name in db.session.query(model.id, model.name)}
+
+
+def prepare_product_type(row, context):
+    name = clean_name(row['Тип продукции'])
+    if not name:
+        raise RejectedRow("пустое название типа продукции")
+    return {'name': name, 'coefficient': to_float(row['Коэффициент типа продукции'], 'Коэффициент типа продукции')}
+
+
+def prepare_material_type(row, context):
+    name = clean_name(row['Тип материала'])
+    if not name:
+        raise RejectedRow("пустое название материала")
+    return {'name': name, 'waste_percentage': parse_waste_percentage(row['Процент потерь сырья'])}
+
+
+def prepare_workshop(row, context):
+    name = clean_name(row['Название цеха'])
+    if not name:
+        raise RejectedRow("пустое название цеха")
+    return {
+        'name': name,
+        'worker_count': 5  # Стандартное количество работников
+    }
+
+
+def record_imported_products(rows, now):
+    """Отмечает загруженную продукцию в журнале изменений: новую - insert, обновленную - update.
+    Новые строки отличаются по created_at, который при обновлении не перезаписывается."""
+    articles = [row['article'] for row in rows]
+    for start in range(0, len(articles), IMPORT_BATCH_SIZE):
+        inserted, updated = [], []
+        for product_id, article, created_at in db.session.query(Product.id, Product.article, Product.created_at)\
+                .filter(Product.article.in_(articles[start:start + IMPORT_BATCH_SIZE])):
+            (inserted if created_at == now else updated).append((product_id, article))
+        record_product_changes(db.session, inserted, 'insert')
+        record_product_changes(db.session, updated, 'update')
+
+
+def product_context():
+    return {
+        'product_types': name_index(ProductType),
+        'material_types': name_index(MaterialType),
+        'now': datetime.utcnow(),
+    }
+
+
+def prepare_product(row, context):
+    article = clean_article(row['Артикул'])
+    if not article:
+        raise RejectedRow("пустой артикул")
+
+    product_type_id = context['product_types'].get(clean_name(row['Тип продукции']))
+    if product_type_id is None:
+        raise RejectedRow(f"неизвестный тип продукции '{row['Тип продукции']}'")
+
+    material_id = context['material_types'].get(clean_name(row['Основной материал']))
+    if material_id is None:
+        raise RejectedRow(f"неизвестный материал '{row['Основной материал']}'")
+
+    return {
+        'article': article,
+        'product_type_id': product_type_id,
+        'name': clean_name(row['Наименование продукции']),
+        'min_cost_for_partner': to_float(row['Минимальная стоимость для партнера'], 'Минимальная стоимость для партнера'),
+        'main_material_id': material_id,
+        'parameter1': 1.0,  # Значение по умолчанию
+        'parameter2': 1.0,  # Значение по умолчанию
+        'created_at': context['now'],
+        'updated_at': context['now'],
+    }
+
+
+def product_workshop_context():
+    return {
+        'products': {name: product_id for product_id, name in db.session.query(Product.id, Product.name)},
+        'workshops': name_index(Workshop),
+    }
+
+
+def prepare_product_workshop(row, context):
+    product_id = context['products'].get(clean_name(row['Наименование продукции']))
+    if product_id is None:
+        raise RejectedRow(f"неизвестная продукция '{row['Наименование продукции']}'")
+
+    workshop_id = context['workshops'].get(clean_name(row['Название цеха']))
+    if workshop_id is None:
+        raise RejectedRow(f"неизвестный цех '{row['Название цеха']}'")
+
+    return {
+        'product_id': product_id,
+        'workshop_id': workshop_id,
+        'time_in_workshop': to_float(row['Время изготовления, ч'], 'Время изготовления, ч'),
+        'worker_count': 3  # Стандартное количество работников
+    }
+
+
+# Таблицы в порядке импорта: (заголовок, файл без расширения, модель, ключ, поля только для вставки,
+# функция подготовки строки, функция загрузки справочников)
+IMPORT_TABLES = [
+    ("Типы продукции", 'Product_type_import', ProductType, ['name'], (),
+     prepare_product_type, dict),
+    ("Типы материалов", 'Material_type_import', MaterialType, ['name'], (),
+     prepare_material_type, dict),
+    ("Цеха", 'Workshops_import', Workshop, ['name'], ('worker_count',),
+     prepare_workshop, dict),
+    ("Продукция", 'Products_import', Product, ['article'], ('parameter1', 'parameter2', 'created_at'),
+     prepare_product, product_context),
+    ("Связи продукции и цехов", 'Product_workshops_import', ProductWorkshop, ['product_id', 'workshop_id'],
+     ('worker_count',), prepare_product_workshop, product_workshop_context),
+]
+
+
+def import_table(table, path, upsert, checkpoint=None, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """Импортирует одну таблицу; с checkpoint читает файл потоково и фиксирует каждый пакет.
+    progress(message) вызывается после каждых IMPORT_BATCH_SIZE прочитанных строк."""
+    title, _, model, key_columns, insert_only, prepare, load_context = table
+    print(f"Импорт: {title} ({path})...")
+    report = ImportReport(title)
+    context = load_context()
+
+    def flush(rows):
+        if upsert:
+            inserted, updated = bulk_upsert(model, key_columns, list(rows.values()), insert_only)
+        else:
+            bulk_insert(model, list(rows.values()))
+            inserted, updated = len(rows), 0
+        report.inserted += inserted
+        report.updated += updated
+        if model is Product:
+            # Пакетная загрузка идет мимо событий сессии, журнал изменений пополняем сами
+            record_imported_products(rows.values(), context['now'])
+
+    if checkpoint is None:
+        rows_iter = read_rows(path)
+        start_row = 0
+    else:
+        rows_iter = stream_rows(path)
+        start_row = checkpoint.position(path)['row']
+        if start_row:
+            print(f"Продолжение с строки {start_row + 1}")
+
+    rows = {}
+    last_row = start_row
+    for row_number, row in rows_iter:
+        if row_number <= start_row:
+            continue
+        last_row = row_number
+        report.read += 1
+        try:
+            values = prepare(row, context)
+        except RejectedRow as e:
+            report.reject(row_number, str(e))
+            continue
+
+        key = tuple(values[column] for column in key_columns)
+        if key in rows:
+            report.reject(row_number, f"повтор ключа {key}")
+            continue
+        rows[key] = values
+
+        if progress is not None and report.read % IMPORT_BATCH_SIZE == 0:
+            progress(f"{title}: прочитано {report.read} строк")
+
+        if checkpoint is not None and report.read % chunk_size == 0:
+            flush(rows)
+            db.session.commit()
+            checkpoint.save(path, last_row)
+            rows = {}
+
+    flush(rows)
+    if checkpoint is not None:
         db.session.commit()
-        print("Импорт данных успешно завершен!")
+        checkpoint.save(path, last_row, done=True)
+    report.finish()
+    return report
+
+
+def clear_data():
+    # Очистка существующих данных
+    print("Очистка существующих данных...")
+    db.session.query(ProductWorkshop).delete()
+    db.session.query(Product).delete()
+    db.session.query(Workshop).delete()
+    db.session.query(MaterialType).delete()
+    db.session.query(ProductType).delete()
+    record_catalog_reset(db.session)
+
+
+def print_summary(reports, started):
+    for report in reports:
+        for row_number, reason in report.rejected:
+            print(f"Отклонено: {report.title}, строка {row_number}: {reason}")
+
+    total_rows = sum(report.read for report in reports)
+    elapsed = time.perf_counter() - started
+    print(f"Импорт данных успешно завершен! {total_rows} строк за {elapsed:.2f} с")
+
+
+def import_data(upsert=False, data_dir='.', progress=None):
+    """Импортирует данные из Excel; в режиме upsert обновляет существующие записи вместо полной очистки.
+
+    Весь импорт, включая очистку, идет одной транзакцией: читатели видят старый каталог
+    до commit, а при сбое или отмене данные остаются прежними.
+    progress(доля, сообщение) вызывается по ходу импорта; исключение из него прерывает импорт."""
+    with app_context():
+        started = time.perf_counter()
+        try:
+            if not upsert:
+                clear_data()
+            reports = []
+            for index, table in enumerate(IMPORT_TABLES):
+                table_progress = None
+                if progress is not None:
+                    fraction = index / len(IMPORT_TABLES)
+                    progress(fraction, f"{table[0]}: чтение файла")
+                    table_progress = lambda message, fraction=fraction: progress(fraction, message)
+                reports.append(import_table(table, find_source(data_dir, table[1]), upsert, progress=table_progress))
+            if progress is not None:
+                progress(0.99, "Пересчет времени изготовления")
+            # Пакетная загрузка идет мимо событий сессии, поэтому время изготовления пересчитываем целиком
+            refresh_production_times()
+            bump_data_version()
+            # COPY идет мимо событий сессии: версию справочников поднимаем явно,
+            # кэши справочников всех процессов обновятся по ней
+            bump_reference_version()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        print_summary(reports, started)
+        return reports
+
+
+def import_data_streaming(upsert=False, resume=False, data_dir='.', chunk_size=IMPORT_CHUNK_SIZE):
+    """Потоковый импорт: файлы читаются пакетами строк, каждый пакет фиксируется отдельно.
+    После сбоя запуск с resume=True продолжает с последнего зафиксированного пакета."""
+    with app_context():
+        started = time.perf_counter()
+        checkpoint = ImportCheckpoint(os.path.join(data_dir, CHECKPOINT_FILE))
+        if not resume:
+            checkpoint.clear()
+            if not upsert:
+                clear_data()
+                db.session.commit()
+
+        reports = []
+        try:
+            for table in IMPORT_TABLES:
+                path = find_source(data_dir, table[1])
+                if checkpoint.position(path)['done']:
+                    print(f"Пропуск таблицы '{table[0]}': уже импортирована")
+                    continue
+                # Пакеты могут повторяться после сбоя, поэтому всегда обновляем по ключу
+                reports.append(import_table(table, path, upsert=True, checkpoint=checkpoint, chunk_size=chunk_size))
+            refresh_production_times()
+            bump_data_version()
+            # COPY идет мимо событий сессии: версию справочников поднимаем явно,
+            # кэши справочников всех процессов обновятся по ней
+            bump_reference_version()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            print("Импорт прерван, для продолжения запустите его с --resume")
+            raise
+
+        checkpoint.clear()
+        print_summary(reports, started)
+        return reports
 
 if __name__ == '__main__':
-    import_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Импорт данных из Excel-файлов')
+    parser.add_argument('--upsert', action='store_true',
+                        help='обновить существующие записи по артикулу и паре продукция-цех без очистки таблиц')
+    parser.add_argument('--stream', action='store_true',
+                        help='читать файлы потоково и фиксировать каждый пакет строк отдельно')
+    parser.add_argument('--resume', action='store_true',
+                        help='продолжить прерванный потоковый импорт с последнего зафиксированного пакета')
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE,
+                        help='количество строк в одном пакете потокового импорта')
+    parser.add_argument('--data-dir', default='.',
+                        help='каталог с файлами импорта (.xlsx или .csv)')
+    parser.add_argument('--reconcile', action='store_true',
+                        help='только сверить сохраненное время изготовления продукции с цехами')
+    parser.add_argument('--create-tables', action='store_true',
+                        help='только создать недостающие таблицы (для SQLite, где не выполняется DataBase.sql)')
+    args = parser.parse_args()
+
+    if args.create_tables:
+        with app_context():
+            db.create_all()
+    elif args.reconcile:
+        with app_context():
+            reconcile_production_times()
+    elif args.stream or args.resume:
+        import_data_streaming(upsert=args.upsert, resume=args.resume,
+                              data_dir=args.data_dir, chunk_size=args.chunk_size)
+    else:
+        import_data(upsert=args.upsert, data_dir=args.data_dir)
@@ -0,0 +1,306 @@
+from models import db, Job
+from factory import app_context
+from flask import current_app
+from sqlalchemy import select
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+import multiprocessing
+import json
+import os
+import socket
+import threading
+import time
+
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+# Прогресс пишется в таблицу задач не чаще, чем раз в столько секунд
+PROGRESS_INTERVAL = 0.5
+# Строк пакетного расчета сырья между проверками отмены
+MATERIAL_BATCH_CHUNK = 10000
+
+_executor = None
+_executor_lock = threading.Lock()
+_stores = {}
+
+
+class JobCancelled(Exception):
+    """Задача отменена пользователем"""
+
+
+class JobStore:
+    """Операции с таблицей задач. Каждая запись - отдельная короткая транзакция на движке
+    bind 'jobs', не связанная с db.session, в которой задача делает свою работу."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.table = Job.__table__
+        self.table.create(engine, checkfirst=True)
+
+    def create(self, kind, params):
+        with self.engine.begin() as connection:
+            return connection.execute(self.table.insert().values(
+                kind=kind, status='queued', params=json.dumps(params, ensure_ascii=False), owner=job_owner(),
+                progress=0.0, cancel_requested=False, created_at=datetime.utcnow())).inserted_primary_key[0]
+
+    def get(self, job_id):
+        with self.engine.connect() as connection:
+            row = connection.execute(select(self.table).where(self.table.c.id == job_id)).mappings().first()
+        return dict(row) if row else None
+
+    def recent(self, limit=50):
+        columns = [column for column in self.table.c if column.name not in ('params', 'result')]
+        with self.engine.connect() as connection:
+            rows = connection.execute(select(*columns).order_by(self.table.c.id.desc()).limit(limit)).mappings()
+            return [dict(row) for row in rows]
+
+    def _update(self, job_id, *conditions, **values):
+        with self.engine.begin() as connection:
+            return connection.execute(self.table.update()
+                                      .where(self.table.c.id == job_id, *conditions)
+                                      .values(**values)).rowcount
+
+    def start(self, job_id):
+        """Переводит задачу в running; False, если ее отменили, пока она ждала в очереди"""
+        return bool(self._update(job_id, self.table.c.status == 'queued',
+                                 status='running', started_at=datetime.utcnow()))
+
+    def report(self, job_id, fraction, message):
+        """Записывает прогресс и возвращает признак запрошенной отмены"""
+        with self.engine.begin() as connection:
+            connection.execute(self.table.update().where(self.table.c.id == job_id)
+                               .values(progress=min(max(fraction, 0.0), 1.0), message=message))
+            return bool(connection.execute(select(self.table.c.cancel_requested)
+                                           .where(self.table.c.id == job_id)).scalar())
+
+    def finish(self, job_id, status, result=None, error=None, message=None):
+        values = {'status': status, 'finished_at': datetime.utcnow(), 'error': error}
+        if status == 'succeeded':
+            values['progress'] = 1.0
+        if result is not None:
+            values['result'] = json.dumps(result, ensure_ascii=False, default=str)
+        if message is not None:
+            values['message'] = message
+        self._update(job_id, **values)
+
+    def cancel(self, job_id):
+        """Задача из очереди отменяется сразу, выполняющаяся - при следующей проверке прогресса"""
+        self._update(job_id, self.table.c.status == 'queued',
+                     status='cancelled', finished_at=datetime.utcnow(), message='Отменена до запуска')
+        self._update(job_id, self.table.c.status == 'running', cancel_requested=True)
+        return self.get(job_id)
+
+    def fail(self, job_id, error):
+        """Завершает ошибкой задачу, которая еще не закончилась сама"""
+        return self._update(job_id, self.table.c.status.in_(('queued', 'running')),
+                            status='failed', finished_at=datetime.utcnow(), error=error)
+
+    def fail_interrupted(self):
+        """Задачи в очереди или в работе, чей процесс завершился, уже не выполнятся.
+        Задачи живых процессов (других веб-воркеров) не трогаем."""
+        active = self.table.c.status.in_(('queued', 'running'))
+        with self.engine.begin() as connection:
+            owners = connection.execute(select(self.table.c.owner).where(active).distinct()).scalars().all()
+            dead = [owner for owner in owners if not _owner_alive(owner)]
+            if not dead:
+                return 0
+            condition = self.table.c.owner.in_([owner for owner in dead if owner is not None])
+            if None in dead:
+                condition = condition | self.table.c.owner.is_(None)
+            return connection.execute(self.table.update()
+                                      .where(active, condition)
+                                      .values(status='failed', finished_at=datetime.utcnow(),
+                                              error='Прервана перезапуском приложения')).rowcount
+
+
+def job_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner):
+    """Жив ли процесс-владелец задачи; процессы на других серверах проверить нельзя - считаем живыми"""
+    if owner is None:
+        return False
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+def job_store():
+    """Хранилище задач текущего приложения; таблица создается при первом обращении"""
+    engine = db.engines['jobs']
+    store = _stores.get(engine)
+    if store is None:
+        store = _stores[engine] = JobStore(engine)
+    return store
+
+
+class JobContext:
+    """Передается обработчику задачи: отчет о прогрессе и проверка отмены"""
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self._last_report = 0.0
+
+    def progress(self, fraction, message=None):
+        now = time.monotonic()
+        if now - self._last_report < PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        if self.store.report(self.job_id, fraction, message):
+            raise JobCancelled()
+
+
+def run_import(context, params):
+    import init_db
+
+    data_dir = resolve_import_dir(params.get('data_dir', '.'), current_app.config['JOBS_IMPORT_ROOT'])
+    reports = init_db.import_data(upsert=bool(params.get('upsert')), data_dir=data_dir, progress=context.progress)
+    return {'tables': [{'title': report.title, 'read': report.read, 'inserted': report.inserted,
+                        'updated': report.updated, 'rejected': len(report.rejected),
+                        'seconds': round(report.elapsed, 2)} for report in reports]}
+
+
+def run_reconcile(context, params):
+    from services import reconcile_production_times
+
+    context.progress(0.0, "Сверка времени изготовления")
+    return {'fixed': reconcile_production_times()}
+
+
+def run_material_batch(context, params):
+    from services import calculate_raw_material_batch
+
+    lines = params.get('lines') or []
+    result = {'lines': [], 'totals': {'lines': 0, 'errors': 0, 'material': 0, 'by_material_type': {}}}
+    for start in range(0, len(lines), MATERIAL_BATCH_CHUNK):
+        context.progress(start / len(lines), f"Рассчитано {start} из {len(lines)} строк")
+        chunk = calculate_raw_material_batch(lines[start:start + MATERIAL_BATCH_CHUNK])
+        result['lines'].extend(chunk['lines'])
+        totals = result['totals']
+        for name in ('lines', 'errors', 'material'):
+            totals[name] += chunk['totals'][name]
+        for material_type_id, total in chunk['totals']['by_material_type'].items():
+            totals['by_material_type'][material_type_id] = totals['by_material_type'].get(material_type_id, 0) + total
+    return result
+
+
+# Вид задачи -> обработчик. Справочники веб-процессов после импорта обновятся сами:
+# ReferenceCache сверяет версию данных
+JOB_HANDLERS = {
+    'import': run_import,
+    'reconcile': run_reconcile,
+    'material_batch': run_material_batch,
+}
+
+
+def resolve_import_dir(data_dir, root):
+    """Каталог импорта внутри разрешенного корня; иначе ValueError"""
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, data_dir))
+    if os.path.commonpath([root, path]) != root or not os.path.isdir(path):
+        raise ValueError(f"Каталог импорта недоступен: {data_dir}")
+    return path
+
+
+def run_job(job_id):
+    """Выполняет задачу в процессе пула: в нем достаточно приложения без веб-части"""
+    with app_context():
+        store = job_store()
+        if not store.start(job_id):
+            return 'cancelled'
+        job = store.get(job_id)
+        handler = JOB_HANDLERS[job['kind']]
+        try:
+            result = handler(JobContext(store, job_id), json.loads(job['params'] or '{}'))
+        except JobCancelled:
+            db.session.rollback()
+            store.finish(job_id, 'cancelled', message='Отменена, изменения не сохранены')
+            return 'cancelled'
+        except Exception as e:
+            db.session.rollback()
+            print(f"Ошибка фоновой задачи {job_id}: {str(e)}")
+            store.finish(job_id, 'failed', error=str(e))
+            return 'failed'
+        store.finish(job_id, 'succeeded', result=result, message='Готово')
+        return 'succeeded'
+
+
+def _executor_for(app):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: рабочие процессы не наследуют соединения с базой и потоки веб-сервера
+            _executor = ProcessPoolExecutor(max_workers=app.config['JOBS_MAX_WORKERS'],
+                                            mp_context=multiprocessing.get_context('spawn'))
+            # Пул новый - задачи завершившихся процессов приложения уже никто не выполнит
+            interrupted = job_store().fail_interrupted()
+            if interrupted:
+                print(f"Фоновых задач прервано перезапуском: {interrupted}")
+        return _executor
+
+
+def _discard_executor(executor):
+    """Убирает сломанный пул (рабочий процесс аварийно завершился); следующий вызов создаст новый"""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def _watch(store, job_id, future):
+    """Задача, чей рабочий процесс погиб, иначе так и осталась бы в running"""
+    def done(future):
+        if future.cancelled():
+            store.fail(job_id, 'Задача снята с выполнения')
+            return
+        error = future.exception()
+        if error is None:
+            return
+        if isinstance(error, BrokenProcessPool):
+            error = 'Рабочий процесс задачи аварийно завершился'
+        print(f"Ошибка фоновой задачи {job_id}: {error}")
+        store.fail(job_id, str(error))
+    future.add_done_callback(done)
+
+
+def submit_job(kind, params):
+    """Ставит задачу в очередь пула процессов; возвращает запись задачи"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Неизвестный вид задачи: {kind}")
+    if kind == 'import':
+        resolve_import_dir(params.get('data_dir', '.'), current_app.config['JOBS_IMPORT_ROOT'])
+
+    executor = _executor_for(current_app)
+    store = job_store()
+    job_id = store.create(kind, params)
+    try:
+        future = executor.submit(run_job, job_id)
+    except BrokenProcessPool:
+        # Пул сломан прошлой аварией - отправляем задачу в новый
+        _discard_executor(executor)
+        try:
+            future = _executor_for(current_app).submit(run_job, job_id)
+        except BrokenProcessPool:
+            store.fail(job_id, 'Пул фоновых задач недоступен')
+            raise
+    _watch(store, job_id, future)
+    return store.get(job_id)
+
+
+def job_json(job, include_result=False):
+    data = {key: value for key, value in job.items() if key not in ('params', 'result')}
+    for key in ('created_at', 'started_at', 'finished_at'):
+        if data.get(key) is not None:
+            data[key] = data[key].isoformat()
+    if include_result and job.get('result'):
+        data['result'] = json.loads(job['result'])
+    return data
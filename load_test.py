@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+async def fetch(reader, writer, host, path):
+    """Отправляет GET по открытому соединению; возвращает (статус, можно ли переиспользовать соединение)"""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n".encode('latin-1'))
+    await writer.drain()
+
+    head = await reader.readuntil(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin-1').split('\r\n')
+    version, status = status_line.split(' ', 2)[:2]
+    headers = {}
+    for line in header_lines:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip().lower()
+
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+        return int(status), False
+
+    keep_alive = version == 'HTTP/1.1' and headers.get('connection') != 'close'
+    return int(status), keep_alive
+
+
+async def client(url, deadline, stats, timeout):
+    """Один клиент: последовательные запросы по keep-alive соединению до истечения времени"""
+    parts = urlsplit(url)
+    port = parts.port or 80
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    connection = None
+
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.wait_for(asyncio.open_connection(parts.hostname, port), timeout)
+            status, keep_alive = await asyncio.wait_for(fetch(*connection, parts.netloc, path), timeout)
+            stats['latencies'].append(time.perf_counter() - started)
+            if status == 200:
+                stats['ok'] += 1
+            else:
+                stats['errors'] += 1
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            stats['errors'] += 1
+            keep_alive = False
+            # Не забиваем сервер мгновенными повторами после отказа
+            await asyncio.sleep(0.05)
+
+        if not keep_alive and connection is not None:
+            connection[1].close()
+            connection = None
+
+    if connection is not None:
+        connection[1].close()
+
+
+async def run_load(url, concurrency, duration, timeout):
+    stats = {'latencies': [], 'ok': 0, 'errors': 0}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(client(url, deadline, stats, timeout) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies = stats['latencies']
+    return {
+        'url': url,
+        'concurrency': concurrency,
+        'requests': stats['ok'] + stats['errors'],
+        'ok': stats['ok'],
+        'errors': stats['errors'],
+        'rps': round(stats['ok'] / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+
+def print_results(results):
+    print(f"{'url':<50} {'клиенты':>8} {'ok':>8} {'ошибки':>7} {'запр/с':>9} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9}")
+    for item in results:
+        print(f"{item['url'][:50]:<50} {item['concurrency']:>8} {item['ok']:>8} {item['errors']:>7} "
+              f"{item['rps']:>9} {str(item['p50_ms']):>9} {str(item['p95_ms']):>9} {str(item['p99_ms']):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест: одни и те же данные через Flask и асинхронный API")
+    parser.add_argument('--url', action='append', required=True,
+                        help="адрес для нагрузки, можно указать несколько раз")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 200],
+                        help="количество одновременных клиентов")
+    parser.add_argument('--duration', type=float, default=10, help="длительность каждого прогона, секунд")
+    parser.add_argument('--timeout', type=float, default=10, help="таймаут запроса, секунд")
+    parser.add_argument('--output', help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    results = []
+    for url in args.url:
+        for concurrency in args.concurrency:
+            result = asyncio.run(run_load(url, concurrency, args.duration, args.timeout))
+            results.append(result)
+            print_results([result])
+
+    print()
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+from flask import g, request, has_request_context, before_render_template, template_rendered, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from collections import Counter
+import logging
+import re
+import threading
+import time
+
+# Границы корзин гистограмм, секунды
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Границы корзин гистограммы количества запросов к БД за HTTP-запрос
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+slow_query_logger = logging.getLogger('slow_queries')
+
+
+class CounterMetric:
+    """Счетчик Prometheus с метками"""
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values = Counter()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class HistogramMetric:
+    """Гистограмма Prometheus с метками"""
+
+    def __init__(self, name, description, label_names=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._values = {}  # метки -> [счетчики корзин, сумма, количество]
+
+    def observe(self, value, labels=()):
+        with self._lock:
+            data = self._values.setdefault(labels, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        bucket_names = self.label_names + ('le',)
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(bucket_names, labels + (str(bound),))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_names, labels + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+REQUESTS = CounterMetric('http_requests_total', 'Количество HTTP-запросов', ('endpoint', 'method', 'status'))
+REQUEST_DURATION = HistogramMetric('http_request_duration_seconds', 'Время обработки HTTP-запроса', ('endpoint',))
+REQUEST_QUERIES = HistogramMetric('http_request_db_queries', 'Количество SQL-запросов за HTTP-запрос', ('endpoint',),
+                                  buckets=QUERY_COUNT_BUCKETS)
+QUERY_DURATION = HistogramMetric('db_query_duration_seconds', 'Время выполнения SQL-запроса')
+TEMPLATE_DURATION = HistogramMetric('template_render_duration_seconds', 'Время рендеринга шаблона', ('template',))
+SLOW_QUERIES = CounterMetric('db_slow_queries_total', 'Количество медленных SQL-запросов')
+N_PLUS_ONE = CounterMetric('db_n_plus_one_total', 'Количество HTTP-запросов с признаками N+1', ('endpoint',))
+
+ALL_METRICS = (REQUESTS, REQUEST_DURATION, REQUEST_QUERIES, QUERY_DURATION, TEMPLATE_DURATION,
+               SLOW_QUERIES, N_PLUS_ONE)
+
+
+def _cache_lines():
+    """Попадания и промахи кэшей приложения (cache.py)"""
+    from cache import response_cache, material_results
+    lines = ["# HELP app_cache_requests_total Обращения к кэшам приложения",
+             "# TYPE app_cache_requests_total counter"]
+    for name, cache in (('response', response_cache), ('material_results', material_results)):
+        for result, value in (('hit', cache.hits), ('miss', cache.misses)):
+            lines.append(f"app_cache_requests_total{_format_labels(('cache', 'result'), (name, result))} {value}")
+    return lines
+
+
+def statement_shape(statement):
+    """Приводит SQL к форме без значений: списки параметров IN и числа сворачиваются"""
+    shape = re.sub(r'\b\d+\b', '?', statement)
+    shape = re.sub(r'\(\s*(?:\?|%\(\w+\)s|%s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|:\w+))*\s*\)', '(?)', shape)
+    return re.sub(r'\s+', ' ', shape).strip()
+
+
+# Настройки из конфигурации приложения, заполняются в init_metrics
+_settings = None
+
+
+def _request_stats():
+    if has_request_context():
+        return g.get('_metrics')
+    return None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    elapsed = time.perf_counter() - started
+    QUERY_DURATION.observe(elapsed)
+
+    stats = _request_stats()
+    if stats is not None:
+        stats['queries'] += 1
+        stats['db_time'] += elapsed
+        stats['shapes'][statement_shape(statement)] += 1
+
+    settings = _settings
+    if settings and elapsed * 1000 >= settings['slow_query_ms']:
+        SLOW_QUERIES.inc()
+        endpoint = request.endpoint if has_request_context() else '-'
+        # Параметры пакетных запросов могут быть огромными, в журнал пишем только начало
+        slow_query_logger.warning("%.1f ms [%s] %s | %s", elapsed * 1000, endpoint,
+                                  re.sub(r'\s+', ' ', statement), repr(parameters)[:500])
+
+
+def _template_started(sender, template, context, **extra):
+    stats = _request_stats()
+    if stats is not None:
+        stats['template_started'] = time.perf_counter()
+
+
+def _template_finished(sender, template, context, **extra):
+    stats = _request_stats()
+    if stats is not None and stats['template_started'] is not None:
+        elapsed = time.perf_counter() - stats['template_started']
+        stats['template_started'] = None
+        stats['template_time'] += elapsed
+        TEMPLATE_DURATION.observe(elapsed, (template.name or 'string',))
+
+
+def init_metrics(app):
+    """Подключает сбор метрик к приложению и регистрирует /metrics"""
+    global _settings
+    _settings = {
+        'slow_query_ms': app.config.get('METRICS_SLOW_QUERY_MS', 100),
+        'n_plus_one_threshold': app.config.get('METRICS_N_PLUS_ONE_THRESHOLD', 10),
+    }
+
+    log_path = app.config.get('METRICS_SLOW_QUERY_LOG')
+    if log_path and not slow_query_logger.handlers:
+        handler = logging.FileHandler(log_path, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_query_logger.addHandler(handler)
+        slow_query_logger.setLevel(logging.WARNING)
+
+    @app.before_request
+    def _start_request_metrics():
+        g._metrics = {'started': time.perf_counter(), 'queries': 0, 'db_time': 0.0,
+                      'template_time': 0.0, 'template_started': None, 'shapes': Counter()}
+
+    @app.after_request
+    def _finish_request_metrics(response):
+        stats = g.pop('_metrics', None)
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats['started']
+        endpoint = request.endpoint or 'unknown'
+
+        REQUESTS.inc((endpoint, request.method, str(response.status_code)))
+        REQUEST_DURATION.observe(elapsed, (endpoint,))
+        REQUEST_QUERIES.observe(stats['queries'], (endpoint,))
+
+        # Один и тот же запрос, повторенный много раз за HTTP-запрос, - признак N+1
+        repeated = [(shape, count) for shape, count in stats['shapes'].items()
+                    if count > _settings['n_plus_one_threshold']]
+        if repeated:
+            N_PLUS_ONE.inc((endpoint,))
+            for shape, count in repeated:
+                slow_query_logger.warning("N+1 [%s %s]: %d повторов: %s", request.method, request.path, count, shape)
+
+        response.headers['Server-Timing'] = (f"db;desc=\"{stats['queries']} queries\";dur={stats['db_time'] * 1000:.1f}, "
+                                             f"tpl;dur={stats['template_time'] * 1000:.1f}, "
+                                             f"total;dur={elapsed * 1000:.1f}")
+        return response
+
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+    @app.route('/metrics')
+    def metrics():
+        lines = []
+        for metric in ALL_METRICS:
+            lines.extend(metric.render())
+        lines.extend(_cache_lines())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -38,11 +38,19 @@ class Product(db.Model):
     main_material_id = db.Column(db.Integer, db.ForeignKey('material_types.id'), nullable=True)
     parameter1 = db.Column(db.Numeric(10, 2), default=0.0)
     parameter2 = db.Column(db.Numeric(10, 2), default=0.0)
-    production_time = db.Column(db.Numeric(10, 2), default=0.0)
+    # Сумма time_in_workshop по связям с цехами, поддерживается событиями сессии (см. services.py)
+    production_time = db.Column(db.Numeric(10, 2), default=0.0, nullable=False)
     
     product_workshops = db.relationship('ProductWorkshop', backref='product', lazy=True, cascade='all, delete-orphan')
     created_at = db.Column(db.TIMESTAMP, default=datetime.utcnow)
     updated_at = db.Column(db.TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Индексы для keyset-пагинации каталога по (значение сортировки, id)
+    __table_args__ = (
+        db.Index('idx_products_name', 'name', 'id'),
+        db.Index('idx_products_cost', 'min_cost_for_partner', 'id'),
+        db.Index('idx_products_production_time', 'production_time', 'id'),
+    )
 
 class ProductWorkshop(db.Model):
     __tablename__ = 'product_workshops'
@@ -52,4 +60,47 @@ class ProductWorkshop(db.Model):
     time_in_workshop = db.Column(db.Numeric(10, 2), default=0.0, nullable=False)
     worker_count = db.Column(db.Integer, default=1, nullable=False)
     
-    __table_args__ = (db.UniqueConstraint('product_id', 'workshop_id', name='uq_product_workshop'),)
\ No newline at end of file
+    __table_args__ = (db.UniqueConstraint('product_id', 'workshop_id', name='uq_product_workshop'),)
+
+class DataVersion(db.Model):
+    """Счетчики версий данных: строка 1 - каталог (любая запись продукции и импорт),
+    строка 2 - справочники (типы продукции, материалы, цеха)"""
+    __tablename__ = 'data_versions'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    changed_at = db.Column(db.TIMESTAMP, default=datetime.utcnow, nullable=False)
+
+class ProductChange(db.Model):
+    """Журнал изменений продукции, только для добавления. Пишется в транзакции самого изменения
+    (см. changes.py); id возрастает в порядке commit и служит курсором ленты /changes"""
+    __tablename__ = 'product_changes'
+    id = db.Column(db.Integer, primary_key=True)
+    # Без внешнего ключа: запись об удалении остается после удаления продукта
+    product_id = db.Column(db.Integer)
+    article = db.Column(db.String(50))
+    # insert, update, delete или reset (каталог загружен заново, product_id пустой)
+    operation = db.Column(db.String(10), nullable=False)
+    # Измененные поля через запятую; пусто - могла измениться вся запись
+    fields = db.Column(db.String(500))
+    version = db.Column(db.Integer, nullable=False)
+    changed_at = db.Column(db.TIMESTAMP, default=datetime.utcnow, nullable=False)
+
+class Job(db.Model):
+    """Фоновая задача (импорт, сверка, пакетный расчет). Хранится в отдельной базе (bind 'jobs'),
+    чтобы прогресс записывался независимо от длинной транзакции самой задачи"""
+    __bind_key__ = 'jobs'
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), default='queued', nullable=False)
+    params = db.Column(db.Text)
+    progress = db.Column(db.Float, default=0.0, nullable=False)
+    message = db.Column(db.String(500))
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    cancel_requested = db.Column(db.Boolean, default=False, nullable=False)
+    # Процесс, в пуле которого выполняется задача: "хост:pid"
+    owner = db.Column(db.String(300))
+    created_at = db.Column(db.TIMESTAMP, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.TIMESTAMP)
+    finished_at = db.Column(db.TIMESTAMP)
@@ -0,0 +1,208 @@
+from models import db, Product, ProductWorkshop
+from cache import reference_cache
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+import heapq
+import re
+
+# Максимальное количество значений в одном условии IN
+QUERY_BATCH_SIZE = 5000
+
+
+def parse_order_text(text):
+    """Разбирает заказ, введенный построчно в формате "артикул количество" """
+    lines = []
+    errors = []
+    for number, raw in enumerate((text or '').splitlines(), start=1):
+        raw = raw.strip()
+        if not raw:
+            continue
+        parts = re.split(r'[\s;,]+', raw)
+        if len(parts) != 2:
+            errors.append(f"Строка {number}: ожидается 'артикул количество'")
+            continue
+        try:
+            quantity = int(parts[1])
+        except ValueError:
+            errors.append(f"Строка {number}: некорректное количество '{parts[1]}'")
+            continue
+        lines.append({'article': parts[0], 'quantity': quantity})
+    return lines, errors
+
+
+def schedule_workshop(jobs, capacity):
+    """Жадно планирует работы цеха на общем пуле работников: длинные работы первыми,
+    каждая работа стартует, как только освобождается нужное число работников.
+
+    jobs - словарь {(часы на единицу, работников на единицу): количество единиц}.
+    Возвращает время завершения всех работ в часах."""
+    now = 0.0
+    free = capacity
+    running = []  # куча (время окончания, занятые работники, номер группы)
+
+    for index, ((hours, workers), count) in enumerate(sorted(jobs.items(), reverse=True)):
+        hours = float(hours)
+        # Работа, требующая больше людей, чем есть в цехе, выполняется всем цехом
+        workers = max(1, min(workers, capacity))
+        while count:
+            started = min(count, free // workers)
+            if started:
+                heapq.heappush(running, (now + hours, started * workers, index))
+                free -= started * workers
+                count -= started
+                continue
+
+            # Свободных работников нет. Если в работе только единицы текущей группы,
+            # расписание повторяется с периодом hours - пропускаем целые периоды сразу.
+            # Последний период проходим обычным порядком, чтобы следующая группа
+            # стартовала в тот же момент, что и без пропуска
+            if all(entry[2] == index for entry in running):
+                in_flight = sum(entry[1] for entry in running) // workers
+                cycles = count // in_flight - 1
+                if cycles > 0:
+                    shift = cycles * hours
+                    running = [(end + shift, busy, group) for end, busy, group in running]
+                    count -= cycles * in_flight
+
+            end, released, _ = heapq.heappop(running)
+            now = end
+            free += released
+
+    return max([now] + [end for end, _, _ in running])
+
+
+def _whole_number(value):
+    """Целое число из числа или строки; None, если значение не целое (2.7 не округляется до 2)"""
+    if isinstance(value, bool):
+        return None
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        return None
+    if not number.is_finite() or number != number.to_integral_value():
+        return None
+    return int(number)
+
+
+def resolve_order(lines):
+    """Сопоставляет строки заказа с продукцией; возвращает ({product_id: количество}, ошибки)"""
+    errors = []
+    articles = {str(line['article']).strip() for line in lines if line.get('product_id') is None and line.get('article')}
+    article_ids = {}
+    articles = list(articles)
+    for start in range(0, len(articles), QUERY_BATCH_SIZE):
+        article_ids.update(db.session.query(Product.article, Product.id)
+                           .filter(Product.article.in_(articles[start:start + QUERY_BATCH_SIZE])))
+
+    # Указанные напрямую ID проверяем так же, как артикулы: продукция должна существовать
+    requested_ids = set()
+    for line in lines:
+        product_id = _whole_number(line.get('product_id'))
+        if product_id is not None:
+            requested_ids.add(product_id)
+    requested_ids = list(requested_ids)
+    known_ids = set()
+    for start in range(0, len(requested_ids), QUERY_BATCH_SIZE):
+        known_ids.update(product_id for (product_id,) in db.session.query(Product.id)
+                         .filter(Product.id.in_(requested_ids[start:start + QUERY_BATCH_SIZE])))
+
+    quantities = defaultdict(int)
+    for number, line in enumerate(lines, start=1):
+        product_id = line.get('product_id')
+        if product_id is None:
+            product_id = article_ids.get(str(line.get('article', '')).strip())
+            missing = f"Строка {number}: продукция '{line.get('article')}' не найдена"
+        else:
+            product_id = _whole_number(line['product_id'])
+            if product_id is None:
+                errors.append(f"Строка {number}: некорректный ID продукции '{line['product_id']}'")
+                continue
+            missing = f"Строка {number}: продукция с ID {product_id} не найдена"
+            if product_id not in known_ids:
+                product_id = None
+        quantity = _whole_number(line.get('quantity'))
+
+        if product_id is None:
+            errors.append(missing)
+        elif quantity is None:
+            errors.append(f"Строка {number}: количество должно быть целым числом")
+        elif quantity <= 0:
+            errors.append(f"Строка {number}: количество должно быть положительным")
+        else:
+            quantities[product_id] += quantity
+    return dict(quantities), errors
+
+
+def plan_production(lines):
+    """Рассчитывает загрузку цехов, узкие места и срок выполнения заказа.
+
+    Связи продукции с цехами не задают порядок прохождения цехов, поэтому цеха
+    считаются параллельно работающими ресурсами: срок заказа равен сроку самого
+    загруженного цеха."""
+    quantities, errors = resolve_order(lines)
+    warnings = []
+
+    # Работы каждого цеха, сгруппированные по (часы, работники) - один проход по маршрутам
+    jobs = defaultdict(lambda: defaultdict(int))
+    units = defaultdict(int)
+    routed = set()
+    product_ids = list(quantities)
+    for start in range(0, len(product_ids), QUERY_BATCH_SIZE):
+        routes = db.session.query(ProductWorkshop.product_id, ProductWorkshop.workshop_id,
+                                  ProductWorkshop.time_in_workshop, ProductWorkshop.worker_count)\
+            .filter(ProductWorkshop.product_id.in_(product_ids[start:start + QUERY_BATCH_SIZE]))
+        for product_id, workshop_id, hours, workers in routes:
+            quantity = quantities[product_id]
+            jobs[workshop_id][(hours, workers)] += quantity
+            units[workshop_id] += quantity
+            routed.add(product_id)
+
+    for product_id in quantities:
+        if product_id not in routed:
+            warnings.append(f"Для продукции с ID {product_id} не заданы цеха")
+
+    workshops_by_id = reference_cache.workshops_by_id()
+    workshops = []
+    for workshop_id, workshop_jobs in jobs.items():
+        workshop = workshops_by_id.get(workshop_id)
+        capacity = workshop.worker_count if workshop else 0
+        labour_hours = sum(float(hours) * workers * count for (hours, workers), count in workshop_jobs.items())
+        longest_job = max(float(hours) for hours, _ in workshop_jobs)
+
+        if capacity <= 0:
+            warnings.append(f"В цехе '{workshop.name if workshop else workshop_id}' не указано количество работников")
+            completion = None
+            lower_bound = None
+        else:
+            for (_, workers), _ in workshop_jobs.items():
+                if workers > capacity:
+                    warnings.append(f"Цеху '{workshop.name}' не хватает работников для одной единицы продукции "
+                                    f"({workers} из {capacity})")
+                    break
+            completion = schedule_workshop(workshop_jobs, capacity)
+            lower_bound = max(labour_hours / capacity, longest_job)
+
+        workshops.append({
+            'id': workshop_id,
+            'name': workshop.name if workshop else str(workshop_id),
+            'worker_count': capacity,
+            'units': units[workshop_id],
+            'labour_hours': round(labour_hours, 2),
+            'lower_bound_hours': round(lower_bound, 2) if lower_bound is not None else None,
+            'completion_hours': round(completion, 2) if completion is not None else None,
+            'utilization': round(labour_hours / (capacity * completion), 3) if completion else None,
+        })
+
+    workshops.sort(key=lambda item: item['completion_hours'] or 0, reverse=True)
+    completion = max((item['completion_hours'] for item in workshops if item['completion_hours'] is not None),
+                     default=0)
+    return {
+        'lines': len(lines),
+        'units': sum(quantities.values()),
+        'completion_hours': completion,
+        'bottlenecks': [item['name'] for item in workshops
+                        if item['completion_hours'] is not None and item['completion_hours'] >= completion > 0],
+        'workshops': workshops,
+        'errors': errors,
+        'warnings': warnings,
+    }
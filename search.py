@@ -0,0 +1,295 @@
+from models import db, Product
+from cache import get_data_version
+from flask import current_app
+from sqlalchemy import event, text, inspect
+from sqlalchemy.orm import Session
+from collections import defaultdict
+import bisect
+import heapq
+import math
+import re
+import threading
+
+# Параметры ранжирования BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Вес слов из названия относительно слов из описания
+NAME_WEIGHT = 2
+# Максимум слов индекса, подставляемых вместо одного префикса из запроса
+MAX_PREFIX_TERMS = 50
+
+_backend = None
+
+
+def tokenize(value):
+    return re.findall(r'\w+', (value or '').lower().replace('ё', 'е'))
+
+
+def document_weights(name, description):
+    """Вес каждого слова продукта: вхождения в название считаются с весом NAME_WEIGHT"""
+    weights = defaultdict(int)
+    for token in tokenize(name):
+        weights[token] += NAME_WEIGHT
+    for token in tokenize(description):
+        weights[token] += 1
+    return weights
+
+
+class SearchIndex:
+    """Инвертированный индекс продукции в памяти процесса: ранжированный поиск по названию
+    и описанию (BM25 с подстановкой префиксов) и автодополнение артикулов.
+
+    Индекс строится при первом поиске и обновляется по событиям сессии; если данные
+    изменились в обход сессии (импорт, другой процесс), он перестраивается по версии данных."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.stale = True
+        self._reset()
+
+    def _reset(self):
+        self.postings = defaultdict(dict)  # слово -> {id продукта: вес вхождений}
+        self.terms = []                    # отсортированный список слов для поиска по префиксу
+        self.documents = {}                # id продукта -> (артикул, название, слова, длина)
+        self.articles = []                 # отсортированный список (артикул, id)
+        self.total_length = 0
+
+    def _add(self, product_id, article, name, description):
+        weights = document_weights(name, description)
+        for token, weight in weights.items():
+            if token not in self.postings:
+                bisect.insort(self.terms, token)
+            self.postings[token][product_id] = weight
+        length = sum(weights.values())
+        self.documents[product_id] = (article, name, tuple(weights), length)
+        self.total_length += length
+        bisect.insort(self.articles, (article, product_id))
+
+    def _remove(self, product_id):
+        document = self.documents.pop(product_id, None)
+        if document is None:
+            return
+        article, _, tokens, length = document
+        for token in tokens:
+            postings = self.postings[token]
+            postings.pop(product_id, None)
+            if not postings:
+                del self.postings[token]
+                position = bisect.bisect_left(self.terms, token)
+                if position < len(self.terms) and self.terms[position] == token:
+                    del self.terms[position]
+        self.total_length -= length
+        position = bisect.bisect_left(self.articles, (article, product_id))
+        if position < len(self.articles) and self.articles[position] == (article, product_id):
+            del self.articles[position]
+
+    def _rebuild(self, version):
+        self._reset()
+        rows = db.session.query(Product.id, Product.article, Product.name, Product.description)\
+            .execution_options(yield_per=5000)
+        postings = defaultdict(dict)
+        articles = []
+        # Сортируем один раз в конце, а не вставкой на каждую строку
+        for product_id, article, name, description in rows:
+            weights = document_weights(name, description)
+            for token, weight in weights.items():
+                postings[token][product_id] = weight
+            length = sum(weights.values())
+            self.documents[product_id] = (article, name, tuple(weights), length)
+            self.total_length += length
+            articles.append((article, product_id))
+        self.postings = postings
+        self.terms = sorted(postings)
+        self.articles = sorted(articles)
+        self.version = version
+        self.stale = False
+
+    def ensure_current(self):
+        version, _ = get_data_version()
+        with self._lock:
+            if self.stale or self.version != version:
+                self._rebuild(version)
+
+    def apply_changes(self, changes, new_version):
+        """Применяет изменения продукции, зафиксированные транзакцией"""
+        with self._lock:
+            if self.stale:
+                return
+            if new_version is not None and self.version != new_version - 1:
+                # Пропущены чужие изменения - индекс перестроится при следующем поиске
+                self.stale = True
+                return
+            for product_id, values in changes.items():
+                self._remove(product_id)
+                if values is not None:
+                    self._add(product_id, *values)
+            if new_version is not None:
+                self.version = new_version
+
+    def _expand(self, token):
+        matches = [token] if token in self.postings else []
+        position = bisect.bisect_left(self.terms, token)
+        while position < len(self.terms) and len(matches) < MAX_PREFIX_TERMS:
+            term = self.terms[position]
+            if not term.startswith(token):
+                break
+            if term != token:
+                matches.append(term)
+            position += 1
+        return matches
+
+    def search(self, query, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            count = len(self.documents)
+            average_length = self.total_length / count if count else 0
+            scores = None
+            for token in tokens:
+                token_scores = defaultdict(float)
+                for term in self._expand(token):
+                    postings = self.postings[term]
+                    idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    # Совпадение по префиксу ценится ниже точного
+                    if term != token:
+                        idf *= 0.5
+                    for product_id, weight in postings.items():
+                        length = self.documents[product_id][3]
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                        token_scores[product_id] = max(token_scores[product_id],
+                                                       idf * weight * (BM25_K1 + 1) / (weight + norm))
+                # Все слова запроса должны найтись в продукте
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {product_id: score + token_scores[product_id]
+                              for product_id, score in scores.items() if product_id in token_scores}
+                if not scores:
+                    return []
+
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            return [{'id': product_id, 'article': self.documents[product_id][0],
+                     'name': self.documents[product_id][1], 'score': round(score, 4)}
+                    for product_id, score in best]
+
+    def autocomplete(self, prefix, limit):
+        with self._lock:
+            position = bisect.bisect_left(self.articles, (prefix,))
+            results = []
+            while position < len(self.articles) and len(results) < limit:
+                article, product_id = self.articles[position]
+                if not article.startswith(prefix):
+                    break
+                results.append({'id': product_id, 'article': article, 'name': self.documents[product_id][1]})
+                position += 1
+            return results
+
+
+search_index = SearchIndex()
+
+
+def search_backend():
+    """'postgresql', если доступны индексы pg_trgm/tsvector, иначе 'memory'"""
+    global _backend
+    if _backend is None:
+        backend = current_app.config.get('SEARCH_BACKEND', 'auto')
+        if backend == 'auto':
+            backend = 'memory'
+            if db.engine.dialect.name == 'postgresql':
+                has_trigram = db.session.execute(
+                    text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+                if has_trigram:
+                    backend = 'postgresql'
+        _backend = backend
+    return _backend
+
+
+def search_products(query, limit=20):
+    """Ранжированный поиск продукции по названию и описанию"""
+    query = (query or '').strip()
+    if not query:
+        return []
+
+    if search_backend() == 'postgresql':
+        # Выражения совпадают с индексами idx_products_search и idx_products_name_trgm из DataBase.sql
+        rows = db.session.execute(text("""
+            SELECT id, article, name,
+                   ts_rank(to_tsvector('russian', coalesce(name, '') || ' ' || coalesce(description, '')),
+                           plainto_tsquery('russian', :query)) + similarity(name, :query) AS score
+            FROM products
+            WHERE to_tsvector('russian', coalesce(name, '') || ' ' || coalesce(description, ''))
+                  @@ plainto_tsquery('russian', :query)
+               OR name % :query
+            ORDER BY score DESC
+            LIMIT :limit
+        """), {'query': query, 'limit': limit})
+        return [{'id': row.id, 'article': row.article, 'name': row.name, 'score': round(float(row.score), 4)}
+                for row in rows]
+
+    search_index.ensure_current()
+    return search_index.search(query, limit)
+
+
+def autocomplete_articles(prefix, limit=10):
+    """Артикулы, начинающиеся с заданного префикса"""
+    prefix = (prefix or '').strip()
+    if not prefix:
+        return []
+
+    if search_backend() == 'postgresql':
+        # Использует индекс idx_products_article_prefix (text_pattern_ops)
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        rows = db.session.query(Product.id, Product.article, Product.name)\
+            .filter(Product.article.like(escaped + '%', escape='\\'))\
+            .order_by(Product.article)\
+            .limit(limit)
+        return [{'id': row.id, 'article': row.article, 'name': row.name} for row in rows]
+
+    search_index.ensure_current()
+    return search_index.autocomplete(prefix, limit)
+
+
+# Синхронизация индекса с правками продукции: изменения собираются при flush
+# и применяются к индексу только после commit
+SEARCH_FIELDS = ('article', 'name', 'description')
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_search_changes(session, flush_context):
+    changes = session.info.setdefault('search_changes', {})
+    for instance in session.new:
+        if isinstance(instance, Product):
+            changes[instance.id] = (instance.article, instance.name, instance.description)
+    for instance in session.dirty:
+        if isinstance(instance, Product):
+            attrs = inspect(instance).attrs
+            if any(getattr(attrs, field).history.has_changes() for field in SEARCH_FIELDS):
+                changes[instance.id] = (instance.article, instance.name, instance.description)
+    for instance in session.deleted:
+        if isinstance(instance, Product):
+            changes[instance.id] = None
+
+
+def record_deleted_products(session, product_ids):
+    """Отмечает продукцию, удаленную массовым DELETE в обход flush"""
+    changes = session.info.setdefault('search_changes', {})
+    for product_id in product_ids:
+        changes[product_id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_search_changes(session):
+    changes = session.info.pop('search_changes', None)
+    new_version = session.info.pop('data_version', None)
+    # Версию продвигаем и без изменений полей поиска (правка цены, пересчет времени),
+    # иначе следующий поиск перестроит индекс целиком
+    if changes or new_version is not None:
+        search_index.apply_changes(changes or {}, new_version)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_search_changes(session):
+    session.info.pop('search_changes', None)
+    session.info.pop('data_version', None)
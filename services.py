@@ -1,11 +1,50 @@
 from models import db, Product, ProductType, MaterialType, Workshop, ProductWorkshop
-from sqlalchemy import func
+from cache import reference_cache, material_results, bump_data_version
+from search import record_deleted_products
+from changes import record_product_changes
+from sqlalchemy import func, or_, and_, select, event, inspect, literal, Numeric
+from sqlalchemy.orm import contains_eager, Session
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+import base64
+import csv
+import io
+import json
+import math
+import tempfile
+
+# Допустимые поля сортировки каталога
+PRODUCT_SORT_FIELDS = ('article', 'name', 'type', 'cost', 'time')
+
+# Поля строки заказа для пакетного расчета сырья
+ORDER_LINE_FIELDS = ('product_type_id', 'material_type_id', 'quantity', 'param1', 'param2')
+
+# Размер пакета id в массовых операциях с продукцией
+BULK_BATCH_SIZE = 5000
+
+# Колонки выгрузки каталога: заголовок и выражение
+EXPORT_COLUMNS = (
+    ('Артикул', Product.article),
+    ('Наименование', Product.name),
+    ('Тип продукции', ProductType.name),
+    ('Основной материал', MaterialType.name),
+    ('Минимальная стоимость для партнера', Product.min_cost_for_partner),
+    ('Время изготовления (часы)', Product.production_time),
+    ('Параметр 1', Product.parameter1),
+    ('Параметр 2', Product.parameter2),
+)
+
+# Точность, до которой округляется результат перед округлением вверх,
+# чтобы погрешность float (2.0000000000000004) не добавляла лишнюю единицу сырья
+MATERIAL_ROUND_DIGITS = 9
+# Верхняя граница результата пакетного расчета: значения должны помещаться в int64
+MAX_MATERIAL_RESULT = 2.0 ** 63
 
 def calculate_production_time(product_id):
-    """Рассчитывает общее время изготовления продукции"""
+    """Возвращает общее время изготовления продукции (сохраненное в products.production_time)"""
     try:
-        total_time = db.session.query(func.sum(ProductWorkshop.time_in_workshop))\
-            .filter(ProductWorkshop.product_id == product_id)\
+        total_time = db.session.query(Product.production_time)\
+            .filter(Product.id == product_id)\
             .scalar() or 0
         
         return round(float(total_time))
@@ -13,21 +52,363 @@ def calculate_production_time(product_id):
         print(f"Ошибка при расчете времени производства: {str(e)}")
         return 0
 
+def refresh_production_times(product_ids=None):
+    """Пересчитывает products.production_time из product_workshops одним UPDATE.
+    Возвращает количество исправленных строк."""
+    # На SQLite SUM считается во float (0.1 + 0.2 != 0.3), поэтому сравниваем с точностью столбца - до копеек часа
+    total_time = select(func.round(func.coalesce(func.sum(ProductWorkshop.time_in_workshop), 0), 2))\
+        .where(ProductWorkshop.product_id == Product.id)\
+        .scalar_subquery()
+    outdated = or_(Product.production_time.is_(None), func.round(Product.production_time, 2) != total_time)
+    # updated_at не трогаем: пересчет не является правкой продукта
+    statement = Product.__table__.update()\
+        .values(production_time=total_time, updated_at=Product.updated_at)
+
+    def refresh(condition):
+        # Пересчет идет мимо событий сессии, поэтому затронутую продукцию отмечаем в журнале изменений сами
+        record_product_changes(db.session, db.session.execute(select(Product.id, Product.article).where(condition)),
+                               'update', ['production_time'])
+        return db.session.execute(statement.where(condition)).rowcount
+
+    if product_ids is None:
+        return refresh(outdated)
+
+    product_ids = list(product_ids)
+    fixed = 0
+    for start in range(0, len(product_ids), 5000):
+        fixed += refresh(and_(outdated, Product.id.in_(product_ids[start:start + 5000])))
+    return fixed
+
+def reconcile_production_times():
+    """Исправляет расхождения сохраненного времени изготовления с product_workshops.
+    Исправления и новая версия данных фиксируются одной транзакцией."""
+    try:
+        fixed = refresh_production_times()
+        if fixed:
+            bump_data_version()
+        db.session.commit()
+        print(f"Время изготовления исправлено у {fixed} продуктов")
+        return fixed
+    except Exception as e:
+        db.session.rollback()
+        print(f"Ошибка при сверке времени производства: {str(e)}")
+        raise
+
+# Инкрементальное обновление products.production_time при изменении связей с цехами.
+# Удаленные и измененные строки учитываются до flush, пока доступны старые значения,
+# новые - после flush, когда у них уже заполнен product_id.
+def _add_time_delta(deltas, product_id, value):
+    if product_id is not None and value:
+        deltas[product_id] = deltas.get(product_id, 0) + Decimal(str(value))
+
+@event.listens_for(Session, 'before_flush')
+def _collect_production_time_changes(session, flush_context, instances):
+    deltas = session.info.setdefault('production_time_deltas', {})
+    for instance in session.deleted:
+        if isinstance(instance, ProductWorkshop):
+            _add_time_delta(deltas, instance.product_id, -Decimal(str(instance.time_in_workshop or 0)))
+
+    for instance in session.dirty:
+        if not isinstance(instance, ProductWorkshop):
+            continue
+        attrs = inspect(instance).attrs
+        product_history = attrs.product_id.history
+        time_history = attrs.time_in_workshop.history
+        if not product_history.has_changes() and not time_history.has_changes():
+            continue
+        old_product_id = product_history.deleted[0] if product_history.deleted else instance.product_id
+        old_time = time_history.deleted[0] if time_history.deleted else instance.time_in_workshop
+        _add_time_delta(deltas, old_product_id, -Decimal(str(old_time or 0)))
+        _add_time_delta(deltas, instance.product_id, instance.time_in_workshop)
+
+@event.listens_for(Session, 'after_flush')
+def _apply_production_time_changes(session, flush_context):
+    deltas = session.info.pop('production_time_deltas', {})
+    for instance in session.new:
+        if isinstance(instance, ProductWorkshop):
+            _add_time_delta(deltas, instance.product_id, instance.time_in_workshop)
+
+    connection = session.connection()
+    products = Product.__table__
+    for product_id, delta in deltas.items():
+        if delta:
+            connection.execute(products.update()
+                               .where(products.c.id == product_id)
+                               .values(production_time=func.coalesce(products.c.production_time, 0) + delta,
+                                       updated_at=products.c.updated_at))
+    session.info['production_time_changed'] = [product_id for product_id, delta in deltas.items() if delta]
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _expire_production_times(session, flush_context):
+    # Загруженные объекты Product должны перечитать новое значение из базы
+    for product_id in session.info.pop('production_time_changed', []):
+        product = session.identity_map.get(inspect(Product).identity_key_from_primary_key((product_id,)))
+        if product is not None:
+            session.expire(product, ['production_time'])
+
+def encode_cursor(value, product_id):
+    """Кодирует позицию последней строки страницы в курсор"""
+    if isinstance(value, Decimal):
+        value = str(value)
+    raw = json.dumps([value, product_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """Раскодирует курсор, при ошибке выбрасывает ValueError"""
+    try:
+        value, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return value, int(product_id)
+    except Exception:
+        raise ValueError(f"Некорректный курсор: {cursor}")
+
+def product_sort_column(sort):
+    """Выражение сортировки каталога; запрос должен быть соединен с product_types"""
+    return {
+        'article': Product.article,
+        'name': Product.name,
+        'type': ProductType.name,
+        'cost': Product.min_cost_for_partner,
+        'time': Product.production_time,
+    }.get(sort, Product.article)
+
+def product_filter_conditions(ids=None, product_type_id=None, material_type_id=None, min_time=None, max_time=None):
+    """Условия отбора продукции для каталога, выгрузки и массовых операций"""
+    conditions = []
+    if ids is not None:
+        conditions.append(Product.id.in_(ids))
+    if product_type_id is not None:
+        conditions.append(Product.product_type_id == product_type_id)
+    if material_type_id is not None:
+        conditions.append(Product.main_material_id == material_type_id)
+    if min_time is not None:
+        conditions.append(Product.production_time >= min_time)
+    if max_time is not None:
+        conditions.append(Product.production_time <= max_time)
+    return conditions
+
+def products_page_statement(sort='article', order='asc', cursor=None, per_page=50, min_time=None, max_time=None):
+    """Строит запрос страницы каталога; возвращает (запрос, поле сортировки, по убыванию).
+    Запрос выполняется как обычной, так и асинхронной сессией."""
+    if sort not in PRODUCT_SORT_FIELDS:
+        sort = 'article'
+    descending = order == 'desc'
+    sort_column = product_sort_column(sort)
+
+    statement = select(Product, sort_column.label('sort_value'))\
+        .join(Product.product_type)\
+        .options(contains_eager(Product.product_type))\
+        .where(*product_filter_conditions(min_time=min_time, max_time=max_time))
+
+    # Продолжаем с позиции (значение сортировки, id) последней строки предыдущей страницы
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        if sort in ('cost', 'time'):
+            try:
+                value = Decimal(str(value))
+                if not value.is_finite():
+                    raise InvalidOperation
+            except InvalidOperation:
+                raise ValueError(f"Некорректный курсор: {cursor}")
+        if descending:
+            statement = statement.where(or_(sort_column < value, and_(sort_column == value, Product.id < last_id)))
+        else:
+            statement = statement.where(or_(sort_column > value, and_(sort_column == value, Product.id > last_id)))
+
+    if descending:
+        statement = statement.order_by(sort_column.desc(), Product.id.desc())
+    else:
+        statement = statement.order_by(sort_column.asc(), Product.id.asc())
+
+    # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+    return statement.limit(per_page + 1), sort, descending
+
+def products_page_result(rows, per_page, sort, descending):
+    """Собирает страницу каталога из строк (продукт, значение сортировки)"""
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    products = [product for product, _ in rows]
+    next_cursor = None
+    if has_more:
+        last_product, last_value = rows[-1]
+        next_cursor = encode_cursor(last_value, last_product.id)
+
+    return {
+        'products': products,
+        'production_times': {product.id: round(float(product.production_time or 0)) for product in products},
+        'next_cursor': next_cursor,
+        'sort': sort,
+        'order': 'desc' if descending else 'asc',
+    }
+
+def get_products_page(sort='article', order='asc', cursor=None, per_page=50, min_time=None, max_time=None):
+    """Возвращает страницу каталога с сортировкой и keyset-курсором на следующую страницу"""
+    statement, sort, descending = products_page_statement(sort, order, cursor, per_page, min_time, max_time)
+    rows = db.session.execute(statement).all()
+    return products_page_result(rows, per_page, sort, descending)
+
+def get_workshop_summary():
+    """Загрузка всех цехов одним запросом: связи с продукцией агрегируются по workshop_id
+    (индекс idx_product_workshops_workshop) и присоединяются к справочнику цехов"""
+    totals = select(ProductWorkshop.workshop_id,
+                    func.count().label('products'),
+                    func.sum(ProductWorkshop.time_in_workshop).label('hours'),
+                    func.sum(ProductWorkshop.time_in_workshop * ProductWorkshop.worker_count).label('labour_hours'))\
+        .group_by(ProductWorkshop.workshop_id)\
+        .subquery()
+    rows = db.session.execute(select(Workshop.id, Workshop.name, Workshop.worker_count,
+                                     totals.c.products, totals.c.hours, totals.c.labour_hours)
+                              .outerjoin(totals, totals.c.workshop_id == Workshop.id)
+                              .order_by(Workshop.name)).all()
+
+    total_labour = sum(float(row.labour_hours or 0) for row in rows)
+    workshops = []
+    for row in rows:
+        labour_hours = float(row.labour_hours or 0)
+        workshops.append({
+            'id': row.id,
+            'name': row.name,
+            'worker_count': row.worker_count,
+            'products': row.products or 0,
+            'hours': round(float(row.hours or 0), 2),
+            'labour_hours': round(labour_hours, 2),
+            # Часы работы всего цеха, чтобы выпустить по одной единице каждой продукции маршрута
+            'load_hours': round(labour_hours / row.worker_count, 2) if row.worker_count else None,
+            'labour_share': round(labour_hours / total_labour, 3) if total_labour else 0,
+        })
+    return {
+        'workshops': workshops,
+        'products': sum(item['products'] for item in workshops),
+        'labour_hours': round(total_labour, 2),
+    }
+
+def get_workshop_products_page(workshop_id, cursor=None, per_page=50):
+    """Продукция, проходящая через цех, страницей по артикулу с keyset-курсором"""
+    statement = select(Product.id, Product.article, Product.name,
+                       ProductWorkshop.time_in_workshop, ProductWorkshop.worker_count)\
+        .join(Product, Product.id == ProductWorkshop.product_id)\
+        .where(ProductWorkshop.workshop_id == workshop_id)
+    if cursor:
+        article, last_id = decode_cursor(cursor)
+        statement = statement.where(or_(Product.article > article, and_(Product.article == article, Product.id > last_id)))
+    rows = db.session.execute(statement.order_by(Product.article, Product.id).limit(per_page + 1)).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1].article, rows[-1].id)
+    return {
+        'products': [{'id': row.id, 'article': row.article, 'name': row.name,
+                      'time_in_workshop': float(row.time_in_workshop), 'worker_count': row.worker_count,
+                      'labour_hours': round(float(row.time_in_workshop) * row.worker_count, 2)}
+                     for row in rows],
+        'next_cursor': next_cursor,
+    }
+
+def filtered_products(conditions):
+    """Пары (id, артикул) продукции, подходящей под условия"""
+    return db.session.execute(select(Product.id, Product.article).where(*conditions).order_by(Product.id)).all()
+
+def bulk_update_products(conditions, min_cost_for_partner=None, cost_change_percent=None,
+                         product_type_id=None, main_material_id=None):
+    """Меняет стоимость, тип продукции или основной материал у всей продукции, подходящей под условия.
+    Выполняется одним UPDATE без загрузки объектов в сессию; RETURNING отдает журналу изменений
+    ровно те строки, что были изменены. Возвращает количество измененных строк."""
+    values = {}
+    if min_cost_for_partner is not None:
+        values['min_cost_for_partner'] = min_cost_for_partner
+    elif cost_change_percent is not None:
+        factor = 1 + Decimal(str(cost_change_percent)) / 100
+        values['min_cost_for_partner'] = func.round(Product.min_cost_for_partner * literal(factor, Numeric(12, 6)), 2)
+    if product_type_id is not None:
+        values['product_type_id'] = product_type_id
+    if main_material_id is not None:
+        values['main_material_id'] = main_material_id
+    if not values:
+        raise ValueError("Не указано, что изменить")
+
+    fields = list(values)
+    values['updated_at'] = datetime.utcnow()
+    statement = Product.__table__.update().where(*conditions).values(**values)
+    if db.engine.dialect.update_returning:
+        products = db.session.execute(statement.returning(Product.id, Product.article)).all()
+    else:
+        # SQLite до 3.35 не знает RETURNING: измененные строки выбираем тем же условием в той же транзакции
+        products = filtered_products(conditions)
+        db.session.execute(statement)
+    record_product_changes(db.session, products, 'update', fields)
+    return len(products)
+
+def delete_products(conditions):
+    """Удаляет продукцию, подходящую под условия, вместе со связями с цехами.
+    Удаление идет пакетами по id, по два DELETE на пакет, без загрузки объектов в сессию.
+    Возвращает количество удаленных продуктов."""
+    rows = filtered_products(conditions)
+    product_ids = [product_id for product_id, _ in rows]
+    links = ProductWorkshop.__table__
+    products = Product.__table__
+    for start in range(0, len(product_ids), BULK_BATCH_SIZE):
+        batch = product_ids[start:start + BULK_BATCH_SIZE]
+        db.session.execute(links.delete().where(links.c.product_id.in_(batch)))
+        db.session.execute(products.delete().where(products.c.id.in_(batch)))
+    record_deleted_products(db.session, product_ids)
+    record_product_changes(db.session, rows, 'delete')
+    return len(product_ids)
+
+def export_products_rows(conditions, sort='article', order='asc'):
+    """Строки выгрузки каталога; читаются с сервера пакетами (на PostgreSQL - серверным курсором)"""
+    sort_column = product_sort_column(sort)
+    statement = select(*(column for _, column in EXPORT_COLUMNS))\
+        .join(ProductType, Product.product_type_id == ProductType.id)\
+        .outerjoin(MaterialType, Product.main_material_id == MaterialType.id)\
+        .where(*conditions)
+    if order == 'desc':
+        statement = statement.order_by(sort_column.desc(), Product.id.desc())
+    else:
+        statement = statement.order_by(sort_column.asc(), Product.id.asc())
+    return db.session.execute(statement.execution_options(yield_per=1000))
+
+def export_products_csv(conditions, sort='article', order='asc'):
+    """Выгрузка каталога в CSV частями по мере чтения строк из базы"""
+    buffer = io.StringIO()
+    # BOM и ";" - чтобы Excel в русской локали открыл файл без мастера импорта
+    buffer.write('\ufeff')
+    writer = csv.writer(buffer, delimiter=';')
+    writer.writerow([title for title, _ in EXPORT_COLUMNS])
+    for rows in export_products_rows(conditions, sort, order).partitions():
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def export_products_xlsx(conditions, sort='article', order='asc', chunk_size=64 * 1024):
+    """Выгрузка каталога в XLSX. Книга пишется в режиме write_only во временный файл
+    (XLSX - zip-архив, отдать его по частям до завершения нельзя), затем файл отдается частями."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Продукция')
+    sheet.append([title for title, _ in EXPORT_COLUMNS])
+    for row in export_products_rows(conditions, sort, order):
+        sheet.append(list(row))
+
+    with tempfile.TemporaryFile() as file:
+        workbook.save(file)
+        file.seek(0)
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
 def calculate_raw_material(product_type_id, material_type_id, quantity, param1, param2):
-    """Рассчитывает количество сырья с учетом потерь"""
+    """Рассчитывает количество сырья с учетом потерь.
+
+    Результат зависит только от пары (тип продукции, материал), площади param1 * param2
+    и количества, поэтому он запоминается в LRU-кэше по этим значениям; множитель пары
+    берется из готовой таблицы reference_cache (к базе - только сверка версии раз за запрос)."""
     try:
-        # Проверяем существование типов продукции и материала
-        product_type = ProductType.query.get(product_type_id)
-        material_type = MaterialType.query.get(material_type_id)
-        
-        if not product_type:
-            print(f"Тип продукции с ID {product_type_id} не найден")
-            return -1
-        
-        if not material_type:
-            print(f"Тип материала с ID {material_type_id} не найден")
-            return -1
-        
         # Проверяем параметры
         if param1 <= 0:
             print(f"Ошибка: Параметр 1 должен быть положительным: {param1}")
@@ -41,46 +422,33 @@ def calculate_raw_material(product_type_id, material_type_id, quantity, param1,
             print(f"Ошибка: Количество должно быть положительным: {quantity}")
             return -1
         
-        print(f"Расчет для: {product_type.name}, материал: {material_type.name}")
-        print(f"Входные данные: quantity={quantity}, param1={param1}, param2={param2}")
+        # Площадь округляется, чтобы 2.5 x 1.2 и 1.2 x 2.5 (или 3 x 1) давали один ключ;
+        # версия справочников в ключе отсекает результаты, посчитанные до их изменения
+        area = round(float(param1) * float(param2), MATERIAL_ROUND_DIGITS)
+        reference_cache.ensure_current()
+        key = (reference_cache.version, product_type_id, material_type_id, float(quantity), area)
+        found, result = material_results.get(key)
+        if found:
+            return result
         
-        # Проверяем коэффициенты и потери
-        if product_type.coefficient is None:
-            print("Ошибка: Коэффициент типа продукции не установлен")
+        # Проверяем существование типов продукции и материала
+        if not reference_cache.product_type(product_type_id):
+            print(f"Тип продукции с ID {product_type_id} не найден")
             return -1
         
-        if material_type.waste_percentage is None:
-            print("Ошибка: Процент потерь материала не установлен")
-            return -1
-            
-        try:
-            material_loss = float(material_type.waste_percentage)
-            coefficient = float(product_type.coefficient)
-        except ValueError:
-            print("Ошибка: Коэффициент или процент потерь не являются числами")
+        if not reference_cache.material_type(material_type_id):
+            print(f"Тип материала с ID {material_type_id} не найден")
             return -1
         
-        print(f"Коэффициент типа продукции: {coefficient}")
-        print(f"Процент потерь материала: {material_loss}")
-        
-        # Основной расчет
-        area = param1 * param2
-        # Явное преобразование обоих операндов к float для гарантированной совместимости
-        base_material = float(area) * float(coefficient)
-        print(f"Базовая площадь: {area}")
-        print(f"Базовое количество сырья: {base_material}")
-        
-        # Рассчитываем коэффициент потерь
-        waste_factor = 1.0 + material_loss
-        print(f"Коэффициент потерь: {waste_factor}")
-        
-        # Рассчитываем общее количество с учетом потерь
-        total_material = base_material * waste_factor * quantity
-        print(f"Итоговое количество сырья до округления: {total_material}")
+        # Множитель отсутствует, только если коэффициент или процент потерь не заданы
+        multiplier = reference_cache.material_multiplier(product_type_id, material_type_id)
+        if multiplier is None:
+            print("Ошибка: Коэффициент типа продукции или процент потерь материала не установлен")
+            return -1
         
         # Возвращаем округленное вверх целое число
-        result = int(total_material + 0.999)  # Округление вверх
-        print(f"Округленный результат: {result}")
+        result = math.ceil(round(area * multiplier * float(quantity), MATERIAL_ROUND_DIGITS))
+        material_results.put(key, result)
         return result
         
     except Exception as e:
@@ -88,3 +456,94 @@ def calculate_raw_material(product_type_id, material_type_id, quantity, param1,
         import traceback
         traceback.print_exc()
         return -1
+
+def _to_number(value):
+    try:
+        return float(str(value).strip().replace(',', '.'))
+    except (TypeError, ValueError):
+        return math.nan
+
+def _lookup(ids, values, keys):
+    """Ищет значения справочника для массива ключей; для отсутствующих ключей возвращает NaN"""
+    import numpy as np
+
+    if len(ids) == 0:
+        return np.full(len(keys), np.nan)
+    order = np.argsort(ids)
+    ids = ids[order]
+    values = values[order]
+    positions = np.clip(np.searchsorted(ids, keys), 0, len(ids) - 1)
+    return np.where(ids[positions] == keys, values[positions], np.nan)
+
+def parse_order_lines_csv(stream):
+    """Читает строки заказа из CSV с колонками product_type_id, material_type_id, quantity, param1, param2.
+    При нечитаемой кодировке выбрасывает ValueError."""
+    data = stream.read()
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        # Excel в русской локали сохраняет CSV в cp1251
+        try:
+            text = data.decode('cp1251')
+        except UnicodeDecodeError:
+            raise ValueError("Не удалось прочитать CSV: ожидается кодировка UTF-8 или Windows-1251")
+    # Excel в русской локали сохраняет CSV с разделителем ";"
+    delimiter = ';' if ';' in text.split('\n', 1)[0] else ','
+    reader = csv.DictReader(io.StringIO(text), delimiter=delimiter)
+    return [{field: row.get(field) for field in ORDER_LINE_FIELDS} for row in reader]
+
+def calculate_raw_material_batch(lines, product_types=None, material_types=None):
+    """Рассчитывает количество сырья для строк заказа за один векторный проход.
+    Справочники по умолчанию берутся из reference_cache."""
+    # numpy загружается только для пакетного расчета
+    import numpy as np
+
+    values = np.array([[_to_number(line.get(field)) for field in ORDER_LINE_FIELDS] for line in lines],
+                      dtype=float).reshape(len(lines), len(ORDER_LINE_FIELDS))
+    product_type_ids, material_type_ids, quantity, param1, param2 = values.T
+
+    # Справочники берутся из кэша один раз на весь заказ
+    if product_types is None:
+        product_types = reference_cache.product_types()
+    if material_types is None:
+        material_types = reference_cache.material_types()
+    coefficients = _lookup(np.array([row.id for row in product_types], dtype=float),
+                           np.array([float(row.coefficient) for row in product_types], dtype=float),
+                           product_type_ids)
+    material_loss = _lookup(np.array([row.id for row in material_types], dtype=float),
+                            np.array([float(row.waste_percentage) for row in material_types], dtype=float),
+                            material_type_ids)
+
+    errors = np.full(len(lines), None, dtype=object)
+    with np.errstate(invalid='ignore', over='ignore'):
+        # inf и nan не проходят проверку положительности вместе с отрицательными значениями
+        errors[~(np.isfinite(param2) & (param2 > 0))] = 'Параметр 2 должен быть положительным'
+        errors[~(np.isfinite(param1) & (param1 > 0))] = 'Параметр 1 должен быть положительным'
+        errors[~(np.isfinite(quantity) & (quantity > 0))] = 'Количество должно быть положительным'
+        errors[np.isnan(material_loss)] = 'Тип материала не найден'
+        errors[np.isnan(coefficients)] = 'Тип продукции не найден'
+        total_material = param1 * param2 * coefficients * (1.0 + material_loss) * quantity
+        # Результат должен поместиться в int64, иначе astype молча даст мусор
+        errors[np.equal(errors, None) & ~(np.round(total_material, MATERIAL_ROUND_DIGITS) < MAX_MATERIAL_RESULT)] = \
+            'Слишком большое количество сырья'
+    valid = np.equal(errors, None)
+
+    results = np.full(len(lines), -1, dtype=np.int64)
+    results[valid] = np.ceil(np.round(total_material[valid], MATERIAL_ROUND_DIGITS)).astype(np.int64)
+
+    material_keys, positions = np.unique(material_type_ids[valid].astype(np.int64), return_inverse=True)
+    # Суммы в целых Python: float в bincount теряет точность, int64 может переполниться
+    material_sums = np.zeros(len(material_keys), dtype=object)
+    np.add.at(material_sums, positions, results[valid].astype(object))
+
+    return {
+        'lines': [dict({field: line.get(field) for field in ORDER_LINE_FIELDS},
+                       result=int(result), error=error)
+                  for line, result, error in zip(lines, results, errors)],
+        'totals': {
+            'lines': len(lines),
+            'errors': int(len(lines) - valid.sum()),
+            'material': int(material_sums.sum()),
+            'by_material_type': {int(key): int(total) for key, total in zip(material_keys, material_sums)},
+        },
+    }